@@ -0,0 +1,269 @@
+import io
+import os
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tempfile
+import timeit
+import numpy as np
+import pandas as pd
+import psycopg2
+from datetime import datetime
+from utils import DATE_FORMAT, copy_batch_to_db, to_epoch_ms
+from schema import AMOUNT_COLUMNS, format_cents, read_transactions
+from queries import transaction_bulk_load
+from reader import row_hashes
+from main import TRANSACTION_COLUMNS, create_table, get_transaction_data, get_user_data, upsert_users
+
+
+def strptime_epoch_ms(dates: pd.Series) -> pd.Series:
+    """
+    Row-wise date conversion used before `to_epoch_ms`, kept as the benchmark baseline.
+
+    :param dates: Series of date strings.
+    :return: Series of epoch milliseconds.
+    """
+    return dates.apply(lambda x: int(datetime.strptime(x, DATE_FORMAT).timestamp() * 1000))
+
+
+def sample_dates(n_rows: int) -> pd.Series:
+    """
+    Generate `n_rows` date strings, one second apart.
+
+    :param n_rows: Number of dates.
+    :return: Series of date strings in `DATE_FORMAT`.
+    """
+    return pd.Series(pd.date_range("2023-06-01", periods=n_rows, freq="s").strftime(DATE_FORMAT))
+
+
+def benchmark_date_conversion(n_rows: int, repeat: int = 3) -> dict:
+    """
+    Time the row-wise and vectorized date conversions on the same input.
+
+    :param n_rows: Number of dates to convert.
+    :param repeat: Number of timed runs, the best one is kept.
+    :return: Dictionary with the best timings in seconds and the speedup.
+    """
+    dates = sample_dates(n_rows)
+    baseline = min(timeit.repeat(lambda: strptime_epoch_ms(dates), number=1, repeat=repeat))
+    vectorized = min(timeit.repeat(lambda: to_epoch_ms(dates), number=1, repeat=repeat))
+
+    return {"rows": n_rows, "strptime": baseline, "vectorized": vectorized, "speedup": baseline / vectorized}
+
+
+def transaction_chunks(n_rows: int, n_agents: int = 1_000, chunk_rows: int = 1_000_000, seed: int = 0):
+    """
+    Generate synthetic transactions in the schema of the daily transaction files.
+
+    The data only depends on the arguments: each chunk has its own random generator seeded with
+    `seed` and the chunk number, and the dates run one second apart from 2023-06-01.
+
+    :param n_rows: Number of rows.
+    :param n_agents: Number of distinct agent phone numbers.
+    :param chunk_rows: Number of rows per chunk, bounds the memory used by the generator.
+    :param seed: Seed of the random generators.
+    :return: Iterator of DataFrames with the columns of the daily transaction files.
+    """
+    for index, start in enumerate(range(0, n_rows, chunk_rows)):
+        size = min(chunk_rows, n_rows - start)
+        rng = np.random.default_rng([seed, index])
+        external_ids = rng.bytes(32 * size).hex()
+        dates = pd.date_range("2023-06-01", periods=size, freq="s") + pd.Timedelta(seconds=start)
+
+        yield pd.DataFrame({
+            "date": dates.strftime(DATE_FORMAT),
+            "externalId": [external_ids[i:i + 64] for i in range(0, 64 * size, 64)],
+            "agentPhoneNumber": 220700000000 + rng.integers(0, n_agents, size),
+            "transactionType": rng.choice(["deposit", "withdrawal", "transfer"], size),
+            "amount": rng.integers(1, 1_000_000, size) / 10,
+            "balance": rng.integers(1, 100_000_000, size) / 10,
+            "receiverPhoneNumber": 220770000000 + rng.integers(0, 10_000_000, size),
+            "commission": rng.integers(0, 10_000, size) / 10,
+        })
+
+
+def write_transactions_csv(path_or_buffer, n_rows: int, n_agents: int = 1_000, seed: int = 0) -> None:
+    """
+    Write a synthetic transactions CSV chunk by chunk (see `transaction_chunks`).
+
+    :param path_or_buffer: File path or text buffer to write to.
+    :param n_rows: Number of rows.
+    :param n_agents: Number of distinct agent phone numbers.
+    :param seed: Seed of the random generators.
+    """
+    buffer = open(path_or_buffer, "w", newline="") if isinstance(path_or_buffer, str) else path_or_buffer
+    try:
+        for index, chunk in enumerate(transaction_chunks(n_rows, n_agents, seed=seed)):
+            chunk.to_csv(buffer, index=False, header=index == 0)
+    finally:
+        if buffer is not path_or_buffer:
+            buffer.close()
+
+
+def sample_transactions_csv(n_rows: int, n_agents: int = 1_000) -> str:
+    """
+    Generate a transactions CSV with `n_rows` rows.
+
+    :param n_rows: Number of rows.
+    :param n_agents: Number of distinct agent phone numbers.
+    :return: CSV text with the columns of the daily transaction files.
+    """
+    buffer = io.StringIO()
+    write_transactions_csv(buffer, n_rows, n_agents)
+
+    return buffer.getvalue()
+
+
+def benchmark_memory(n_rows: int) -> dict:
+    """
+    Compare the memory of a transactions frame read with inferred dtypes and with the declared schema.
+
+    :param n_rows: Number of rows to generate.
+    :return: Dictionary with the deep memory usage in bytes of both frames and their ratio.
+    """
+    text = sample_transactions_csv(n_rows)
+    # pandas 3 infers Arrow strings by itself, compare against the object columns older releases infer
+    with pd.option_context("future.infer_string", False):
+        inferred = pd.read_csv(io.StringIO(text)).memory_usage(deep=True).sum()
+    declared = read_transactions(io.StringIO(text)).memory_usage(deep=True).sum()
+
+    return {"rows": n_rows, "inferred": int(inferred), "schema": int(declared), "ratio": inferred / declared}
+
+
+def benchmark_pipeline(n_rows: int, cur=None, engine: str = "pandas", workdir: str = None) -> dict:
+    """
+    Time each stage of the test1 pipeline on a synthetic transactions file.
+
+    The database stages only run when a cursor is given. They write to the user and transaction
+    tables inside a transaction that the caller is expected to roll back.
+
+    :param n_rows: Number of rows to generate.
+    :param cur: Optional cursor of a disposable PostgreSQL database, on a connection without autocommit.
+    :param engine: Dataframe backend of the transforms, one of `engines.ENGINES`.
+    :param workdir: Directory for the generated file, a temporary directory by default.
+    :return: Dictionary with the stage timings in seconds, None for the stages that did not run.
+    """
+    stages = {}
+
+    def timed(stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        stages[stage] = time.perf_counter() - start
+        return result
+
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        path = os.path.join(tmp, "transactions.csv")
+        timed("generate", write_transactions_csv, path, n_rows)
+        df = timed("read", read_transactions, path)
+
+    df = timed("dedupe", df.drop_duplicates)
+    df_users = timed("user_aggregation", get_user_data, df, engine)
+    df_transaction = timed("date_conversion", get_transaction_data, df, engine)
+    timed("hashing", row_hashes, df)
+
+    if cur is None:
+        stages["user_resolution"] = None
+        stages["load"] = None
+    else:
+        create_table(cur)
+        users_uuids = timed("user_resolution", upsert_users, cur, df_users)
+        df_join = df_transaction.merge(users_uuids, on="agentPhoneNumber", how="inner")
+        df_join.rename(columns={"uuid": "userUuid"}, inplace=True)
+        for column in AMOUNT_COLUMNS:
+            df_join[column] = format_cents(df_join[column])
+        timed("load", copy_batch_to_db, cur, transaction_bulk_load, df_join[TRANSACTION_COLUMNS])
+
+    total = sum(seconds for stage, seconds in stages.items() if seconds is not None and stage != "generate")
+
+    return {"rows": n_rows, "engine": engine, "stages": stages, "total": total,
+            "rows_per_second": n_rows / total if total else None}
+
+
+def compare_results(baseline: dict, results: dict) -> None:
+    """
+    Print the stage timings of two benchmark runs side by side.
+
+    :param baseline: Results saved by an earlier run.
+    :param results: Results of this run.
+    """
+    previous = {(run["rows"], run["engine"]): run for run in baseline["results"]}
+    for run in results["results"]:
+        old = previous.get((run["rows"], run["engine"]))
+        if old is None:
+            continue
+        print(f"{run['rows']} rows ({run['engine']}) against {baseline.get('commit') or 'baseline'}:")
+        for stage, seconds in run["stages"].items():
+            before = old["stages"].get(stage)
+            if seconds is None or not before:
+                continue
+            print(f"  {stage:<17} {before:8.3f}s -> {seconds:8.3f}s ({seconds / before:.2f}x)")
+
+
+def git_commit() -> str:
+    """
+    :return: The commit the benchmark runs on, None outside of a git checkout.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the transaction pipeline on synthetic data.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 1_000_000, 10_000_000],
+                        help="numbers of rows to generate, one run each")
+    parser.add_argument("--engine", default="pandas", help="dataframe backend of the transforms")
+    parser.add_argument("--db", action="store_true",
+                        help="also time the database stages against DB_HOST/PORT/DB/USER/PASS, rolled back after each run")
+    parser.add_argument("--micro", action="store_true", help="also compare the date conversions and dataframe memory")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = {
+        "commit": git_commit(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "results": [],
+    }
+
+    for n_rows in args.rows:
+        if args.db:
+            conn = psycopg2.connect(host=os.environ.get("DB_HOST"), port=os.environ.get("PORT"),
+                                    database=os.environ.get("DB"), user=os.environ.get("USER"),
+                                    password=os.environ.get("PASS"))
+            try:
+                with conn.cursor() as cur:
+                    run = benchmark_pipeline(n_rows, cur, args.engine)
+            finally:
+                conn.rollback()
+                conn.close()
+        else:
+            run = benchmark_pipeline(n_rows, engine=args.engine)
+        results["results"].append(run)
+
+        timings = ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in run["stages"].items() if seconds is not None)
+        print(f"pipeline, {n_rows} rows: {timings} ({run['rows_per_second']:.0f} rows/sec)")
+
+        if args.micro:
+            result = benchmark_date_conversion(n_rows)
+            print(f"date conversion, {result['rows']} rows: strptime {result['strptime']:.3f}s, "
+                  f"vectorized {result['vectorized']:.3f}s ({result['speedup']:.1f}x)")
+
+            result = benchmark_memory(n_rows)
+            print(f"dataframe memory, {result['rows']} rows: inferred {result['inferred'] / 2 ** 20:.1f} MiB, "
+                  f"schema {result['schema'] / 2 ** 20:.1f} MiB ({result['ratio']:.1f}x smaller)")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            compare_results(json.load(file), results)
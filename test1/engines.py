@@ -0,0 +1,111 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from utils import DATE_FORMAT, local_offsets_ms
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+# dataframe backends the transforms can run on, pandas is the reference implementation
+ENGINES = ("pandas", "arrow", "polars")
+
+
+def check_engine(engine: str) -> None:
+    """
+    Make sure a transform engine is known and its library is installed.
+
+    :param engine: One of `ENGINES`.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"unknown engine {engine!r}, expected one of {ENGINES}")
+    if engine == "polars" and pl is None:
+        raise ImportError("the polars engine needs the polars package installed")
+
+
+def user_data_arrow(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Arrow compute version of `main.get_user_data`.
+
+    :param df: Input DataFrame containing transaction data.
+    :return: DataFrame with the `agentPhoneNumber` and `nTransactions` columns.
+    """
+    table = pa.Table.from_pandas(df[["agentPhoneNumber"]], preserve_index=False)
+    users = (table.group_by("agentPhoneNumber")
+             .aggregate([("agentPhoneNumber", "count")])
+             .rename_columns(["agentPhoneNumber", "nTransactions"])
+             .sort_by("agentPhoneNumber"))
+    users = users.to_pandas()
+    users["agentPhoneNumber"] = users["agentPhoneNumber"].astype(df["agentPhoneNumber"].dtype)
+
+    return users
+
+
+def transaction_data_arrow(df: pd.DataFrame, tz=None) -> pd.DataFrame:
+    """
+    Arrow compute version of `main.get_transaction_data`.
+
+    Only the `date` column is converted to Arrow, the other columns are passed through untouched.
+
+    :param df: Input DataFrame containing transaction data.
+    :param tz: Timezone the dates are recorded in, see `utils.to_epoch_ms`.
+    :return: The transaction data with `date`, `requestTimestamp` and `updateTimestamp` in epoch milliseconds.
+    """
+    wall = pc.strptime(pa.array(df["date"], pa.string()), format=DATE_FORMAT, unit="ms")
+    minutes = pc.floor_temporal(wall, unit="minute")
+    unique_minutes = pc.unique(minutes)
+    offsets = pa.array(local_offsets_ms(unique_minutes.cast(pa.int64()).to_numpy(), tz), pa.int64())
+    epoch_ms = pc.add(wall.cast(pa.int64()), offsets.take(pc.index_in(minutes, value_set=unique_minutes))).to_numpy()
+
+    df_transaction = df.copy(deep=False)
+    df_transaction["date"] = epoch_ms
+    df_transaction["requestTimestamp"] = epoch_ms
+    df_transaction["updateTimestamp"] = epoch_ms
+
+    return df_transaction
+
+
+def user_data_polars(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Polars lazy frame version of `main.get_user_data`.
+
+    :param df: Input DataFrame containing transaction data.
+    :return: DataFrame with the `agentPhoneNumber` and `nTransactions` columns.
+    """
+    users = (pl.from_pandas(df[["agentPhoneNumber"]]).lazy()
+             .group_by("agentPhoneNumber")
+             .agg(pl.len().cast(pl.Int64).alias("nTransactions"))
+             .sort("agentPhoneNumber")
+             .collect())
+    users = users.to_pandas()
+    users["agentPhoneNumber"] = users["agentPhoneNumber"].astype(df["agentPhoneNumber"].dtype)
+
+    return users
+
+
+def transaction_data_polars(df: pd.DataFrame, tz=None) -> pd.DataFrame:
+    """
+    Polars lazy frame version of `main.get_transaction_data`.
+
+    Only the `date` column is converted to Polars, the other columns are passed through untouched.
+
+    :param df: Input DataFrame containing transaction data.
+    :param tz: Timezone the dates are recorded in, see `utils.to_epoch_ms`.
+    :return: The transaction data with `date`, `requestTimestamp` and `updateTimestamp` in epoch milliseconds.
+    """
+    frame = pl.from_pandas(df[["date"]]).lazy().select(
+        pl.col("date").str.strptime(pl.Datetime("ms"), DATE_FORMAT).dt.epoch("ms").alias("wall"),
+    ).with_columns(
+        (pl.col("wall") // 60_000 * 60_000).alias("minute"),
+    ).collect()
+    unique_minutes = frame["minute"].unique()
+    offsets = dict(zip(unique_minutes.to_list(), local_offsets_ms(unique_minutes.to_numpy(), tz)))
+    epoch_ms = (frame["wall"] + frame["minute"].replace_strict(offsets, return_dtype=pl.Int64)).to_numpy()
+
+    df_transaction = df.copy(deep=False)
+    df_transaction["date"] = epoch_ms
+    df_transaction["requestTimestamp"] = epoch_ms
+    df_transaction["updateTimestamp"] = epoch_ms
+
+    return df_transaction
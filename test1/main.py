@@ -1,52 +1,215 @@
+import numpy as np
 import pandas as pd
-import json
 import os
+import argparse
 import psycopg2
-from copy import deepcopy
-from datetime import datetime
-from uuid import uuid4
-from utils import (establish_connection, run_sql_query, write_batch_to_db)
-from queries import (create_user_table, users_insert, create_transaction_table, transaction_insert)
+from utils import (database_cursor, run_sql_query, copy_batch_to_db, to_epoch_ms)
+from metrics import COLLECTED, measure, to_openmetrics
+from profiling import profiled
+from schema import AMOUNT_COLUMNS, format_cents
+from reader import (RANGE_BYTES, bounded_map, first_seen, range_tasks, read_range, read_transaction_files,
+                    row_hashes)
+from engines import (check_engine, user_data_arrow, transaction_data_arrow, user_data_polars,
+                     transaction_data_polars)
+from queries import (create_user_table, users_insert, create_transaction_table, transaction_insert,
+                     users_bulk_load, users_lookup, transaction_bulk_load)
 
+# columns written to the transaction table
+TRANSACTION_COLUMNS = ["agentPhoneNumber", "receiverPhoneNumber", "transactionType", "userUuid", "balance",
+                       "commission", "amount", "requestTimestamp", "updateTimestamp", "externalId"]
 
-def get_user_data(df: pd.DataFrame) -> pd.DataFrame:
+
+@profiled
+def get_user_data(df: pd.DataFrame, engine: str = "pandas") -> pd.DataFrame:
     """
-    This function calculates the 'nTransactions' column and generates a 'userUuid'
+    This function calculates the 'nTransactions' column of every agent, their uuids are assigned by the
+    user table (see `upsert_users`). Only the 'agentPhoneNumber' column is read, the input DataFrame is
+    left unchanged.
     :param df: pandas.DataFrame
         Input DataFrame containing transaction data.
+    :param engine: str
+        Dataframe backend running the transform, one of `engines.ENGINES`.
 
     :return: pandas.DataFrame
         Processed DataFrame containing user data.
     """
-    df["nTransactions"] = 1
-    df_users_comp = df.groupby("agentPhoneNumber").agg({"nTransactions": "sum"}).reset_index()
-    df_users_comp["userUuid"] = df_users_comp["agentPhoneNumber"].apply(lambda x: str(uuid4()))
-    df_users_comp.rename(columns={"userUuid": "uuid"}, inplace=True)
+    check_engine(engine)
+    if engine == "arrow":
+        return user_data_arrow(df)
+    if engine == "polars":
+        return user_data_polars(df)
+
+    counts = df["agentPhoneNumber"].value_counts(sort=False).sort_index().astype("int64")
+    df_users_comp = counts.rename("nTransactions").reset_index()
 
     return df_users_comp
 
 
-def get_transaction_data(df: pd.DataFrame) -> pd.DataFrame:
+@profiled
+def get_transaction_data(df: pd.DataFrame, engine: str = "pandas") -> pd.DataFrame:
     """
     This function transforms the 'date' column to a timestamp format, updating 'requestTimestamp' and 'updateTimestamp'
-    columns with the converted values.
+    columns with the converted values. The result is a shallow copy sharing the other columns with the input
+    DataFrame, which is left unchanged.
 
     :param df: pandas.DataFrame
         Input DataFrame containing transaction data.
+    :param engine: str
+        Dataframe backend running the transform, one of `engines.ENGINES`.
 
     :return: pandas.DataFrame
         Processed DataFrame containing transaction data.
     """
-    df["date"] = df["date"].apply(
-        lambda x: int(
-            datetime.strptime(x, "%Y-%m-%d %H:%M:%S").timestamp() * 1000
-        )
-    )
+    check_engine(engine)
+    if engine == "arrow":
+        return transaction_data_arrow(df)
+    if engine == "polars":
+        return transaction_data_polars(df)
+
+    epoch_ms = to_epoch_ms(df["date"])
+
+    df_transaction = df.copy(deep=False)
+    df_transaction["date"] = epoch_ms
+    df_transaction["requestTimestamp"] = epoch_ms
+    df_transaction["updateTimestamp"] = epoch_ms
+
+    return df_transaction
+
+
+@profiled
+def upsert_users(cur, df_users: pd.DataFrame) -> pd.DataFrame:
+    """
+    Insert the new users and resolve the uuids of all of them.
+
+    The bulk load merge returns 'phoneNumber, uuid' for every user it is given, so the uuids stored in the
+    user table come back with the insert itself. If the batch insert fallback was used, they are read back
+    with a single lookup.
+
+    :param cur:
+        Database cursor for executing SQL queries.
+    :param df_users: pandas.DataFrame
+        User data from `get_user_data`.
+    :return: pandas.DataFrame
+        DataFrame with the 'agentPhoneNumber' and 'uuid' columns.
+    """
+    returned = copy_batch_to_db(cur, users_bulk_load, df_users, users_insert)
+    phone_numbers = df_users["agentPhoneNumber"].astype(str).tolist()
+    if len(returned) < len(phone_numbers):
+        cur.execute(users_lookup, {"phone_numbers": phone_numbers})
+        returned = cur.fetchall()
 
-    df["requestTimestamp"] = df["date"]
-    df["updateTimestamp"] = df["date"]
+    df_uuids = pd.DataFrame([row[:2] for row in returned], columns=["agentPhoneNumber", "uuid"])
+    df_uuids["agentPhoneNumber"] = df_uuids["agentPhoneNumber"].astype(df_users["agentPhoneNumber"].dtype)
+    df_uuids["uuid"] = df_uuids["uuid"].astype(str)
 
-    return df
+    return df_uuids
+
+
+def prepare_transactions(df: pd.DataFrame, users_uuids: pd.DataFrame, engine: str = "pandas") -> pd.DataFrame:
+    """
+    Build the rows of the transaction table: timestamps from `get_transaction_data`, the agent's uuid as
+    'userUuid' and the amounts formatted as decimals.
+
+    :param df: pandas.DataFrame
+        Input DataFrame containing transaction data.
+    :param users_uuids: pandas.DataFrame
+        DataFrame with the 'agentPhoneNumber' and 'uuid' columns, from `upsert_users`.
+    :param engine: str
+        Dataframe backend running the transform, one of `engines.ENGINES`.
+
+    :return: pandas.DataFrame
+        DataFrame with the `TRANSACTION_COLUMNS`.
+    """
+    df_transaction_join = get_transaction_data(df, engine).merge(users_uuids, on="agentPhoneNumber", how="inner")
+    df_transaction_join.rename(columns={"uuid": "userUuid"}, inplace=True)
+    for column in AMOUNT_COLUMNS:
+        df_transaction_join[column] = format_cents(df_transaction_join[column])
+
+    return df_transaction_join[TRANSACTION_COLUMNS]
+
+
+def scan_range(path: str, start: int, end: int, columns: list[str]) -> tuple[np.ndarray, pd.Series]:
+    """
+    Parse a byte range and return what the first pass of `load_mapped` needs from it, see `reader.read_range`
+    for the arguments.
+
+    :return: Row hashes and the 'agentPhoneNumber' column of the range.
+    """
+    df = read_range(path, start, end, columns)
+
+    return row_hashes(df), df["agentPhoneNumber"]
+
+
+def transform_range(path: str, start: int, end: int, columns: list[str], keep: np.ndarray,
+                    users_uuids: pd.DataFrame, engine: str) -> pd.DataFrame:
+    """
+    Parse a byte range again, keep its new rows and prepare them for the transaction table.
+
+    :param keep: np.ndarray
+        Mask of the range's rows not seen before, from the first pass of `load_mapped`.
+    :param users_uuids: pandas.DataFrame
+        DataFrame with the 'agentPhoneNumber' and 'uuid' columns.
+    :param engine: str
+        Dataframe backend running the transform.
+    :return: DataFrame with the `TRANSACTION_COLUMNS`.
+    """
+    return prepare_transactions(read_range(path, start, end, columns)[keep], users_uuids, engine)
+
+
+def load_mapped(cur, sources: list[str], engine: str = "pandas", processes: int = None,
+                range_bytes: int = RANGE_BYTES) -> None:
+    """
+    Load large CSV files with bounded memory, parsing memory-mapped byte ranges of them in parallel workers.
+
+    The files are read twice. The first pass drops the repeated rows by their hashes and counts the
+    transactions of every agent with `get_user_data`, so the users can be upserted before any
+    transaction. The second pass parses the ranges again and prepares and copies their new rows one
+    range at a time. Besides the ranges in flight, the parent keeps 9 bytes per row: the sorted row hashes
+    during the first pass and the row masks for the second. Both passes give the same tables as
+    reading the files whole.
+
+    :param cur:
+        Database cursor for executing SQL queries.
+    :param sources: list[str]
+        File paths, directories or glob patterns, see `reader.expand_paths`.
+    :param engine: str
+        Dataframe backend running the transforms, one of `engines.ENGINES`.
+    :param processes: int
+        Number of worker processes, one per CPU by default.
+    :param range_bytes: int
+        Approximate size of the byte ranges.
+    """
+    tasks = range_tasks(sources, range_bytes)
+
+    with measure("extract") as metrics:
+        seen = np.empty(0, dtype=np.uint64)
+        masks, user_counts = [], []
+        results = bounded_map(scan_range, tasks, processes)
+        for (path, start, end, columns), (hashes, phone_numbers) in zip(tasks, results):
+            keep, seen = first_seen(hashes, seen)
+            masks.append(keep)
+            user_counts.append(get_user_data(phone_numbers[keep].to_frame(), engine))
+            metrics.add(rows_in=len(keep), rows_out=keep.sum(), bytes_read=end - start)
+        del seen
+
+    with measure("transform_users") as metrics:
+        users_df_data = (pd.concat(user_counts)
+                         .groupby("agentPhoneNumber", sort=True, as_index=False)["nTransactions"].sum())
+        metrics.add(rows_in=sum(map(len, user_counts)), rows_out=len(users_df_data))
+    print("writing data to user table........")
+    with measure("load_users") as metrics:
+        users_uuids = upsert_users(cur, users_df_data)
+        metrics.add(rows_in=len(users_df_data), rows_out=len(users_uuids))
+
+    # the transactions are transformed in the workers, so their transform is part of the load stage
+    print("writing data to transaction table........")
+    with measure("load") as metrics:
+        tasks = [task + (keep, users_uuids, engine) for task, keep in zip(tasks, masks)]
+        for df_transaction in bounded_map(transform_range, tasks, processes):
+            if df_transaction.empty:
+                continue
+            metrics.add(rows_in=len(df_transaction))
+            copy_batch_to_db(cur, transaction_bulk_load, df_transaction, transaction_insert)
 
 
 def create_table(cur):
@@ -63,32 +226,52 @@ def create_table(cur):
 
 if __name__ == "__main__":
 
-    transactions_columns = ["agentPhoneNumber", "receiverPhoneNumber", "transactionType", "userUuid", "balance",
-                            "commission", "amount", "requestTimestamp", "updateTimestamp", "externalId"]
-    dir = ["/Users/apple/Downloads/transactions-1.csv", "/Users/apple/Downloads/transactions-2.csv"]
+    parser = argparse.ArgumentParser(description="Load transactions CSV files into the database.")
+    parser.add_argument("sources", nargs="+", help="CSV files, directories of CSV files or glob patterns")
+    parser.add_argument("--processes", type=int,
+                        help="number of worker processes parsing the files, one per CPU by default")
+    parser.add_argument("--mmap", action="store_true",
+                        help="parse memory-mapped byte ranges of the files in parallel and load them range by range, "
+                             "for files too large to hold in memory (range size from RANGE_MB)")
+    args = parser.parse_args()
 
     host = os.environ.get("DB_HOST")
     user = str(os.environ.get("USER"))
     port = str(os.environ.get("PORT"))
     db = os.environ.get("DB")
     password = os.environ.get("PASS")
-    cur = establish_connection(host=host, user=user, port=port, db=db,
-                               password=password)
-    create_table(cur)
+    # dataframe backend of the transforms: pandas, arrow or polars
+    engine = os.environ.get("TRANSFORM_ENGINE", "pandas")
+    # file the stage metrics are written to in the OpenMetrics text format, unset to only print them
+    metrics_path = os.environ.get("METRICS_PATH")
+    with database_cursor(host=host, user=user, port=port, db=db, password=password) as cur:
+        create_table(cur)
 
-    df_transaction = pd.concat(map(pd.read_csv, dir))
-    df_transaction.drop_duplicates(inplace=True)
+        if args.mmap:
+            load_mapped(cur, args.sources, engine, args.processes)
+        else:
+            with measure("extract"):
+                df_transaction = read_transaction_files(args.sources, args.processes)
 
-    # users data
-    df_users = deepcopy(df_transaction)
-    users_df_data = get_user_data(df_users)
-    print("writing data to user table........")
-    write_batch_to_db(cur, users_insert, json.loads(users_df_data.to_json(orient="records")))
+            # users data
+            with measure("transform_users") as metrics:
+                users_df_data = get_user_data(df_transaction, engine)
+                metrics.add(rows_in=len(df_transaction), rows_out=len(users_df_data))
+            print("writing data to user table........")
+            with measure("load_users") as metrics:
+                users_uuids = upsert_users(cur, users_df_data)
+                metrics.add(rows_in=len(users_df_data), rows_out=len(users_uuids))
 
-    # transaction_data
-    # format transaction
-    df_transaction_join = get_transaction_data(df_transaction).merge(users_df_data, on="agentPhoneNumber", how="inner")
-    df_transaction_join.rename(columns={"uuid": "userUuid"}, inplace=True)
-    transaction_df_data = df_transaction_join[transactions_columns].to_json(orient="records")
-    print("writing data to transaction table........")
-    write_batch_to_db(cur, transaction_insert, json.loads(transaction_df_data))
+            # transaction_data
+            # format transaction
+            with measure("transform_transactions") as metrics:
+                df_transaction_join = prepare_transactions(df_transaction, users_uuids, engine)
+                metrics.add(rows_in=len(df_transaction), rows_out=len(df_transaction_join))
+            print("writing data to transaction table........")
+            with measure("load") as metrics:
+                metrics.add(rows_in=len(df_transaction_join))
+                copy_batch_to_db(cur, transaction_bulk_load, df_transaction_join, transaction_insert)
+
+    if metrics_path:
+        with open(metrics_path, "w") as file:
+            file.write(to_openmetrics(COLLECTED))
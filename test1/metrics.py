@@ -0,0 +1,101 @@
+import json
+import time
+import resource
+import contextvars
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar("stage_metrics", default=None)
+
+# summaries of the stages measured in this process, in the order they finished
+COLLECTED = []
+
+
+class StageMetrics:
+    """
+    Counters and timings of one pipeline stage.
+
+    Helpers add to the metrics of the stage they run in through `current_metrics`.
+    """
+
+    COUNTERS = ("rows_in", "rows_out", "bytes_read", "rows_inserted", "rows_skipped")
+
+    def __init__(self, name: str):
+        """
+        :param name: Stage name.
+        """
+        self.name = name
+        self.counts = dict.fromkeys(self.COUNTERS, 0)
+        self.duration = None
+        self.peak_rss_mb = None
+
+    def add(self, **counts) -> None:
+        """
+        Add to the stage's counters.
+
+        :param counts: Amounts keyed by counter name, see `COUNTERS`.
+        """
+        for counter, amount in counts.items():
+            self.counts[counter] += int(amount)
+
+    def summary(self) -> dict:
+        """
+        :return: Dictionary with the stage's counters, duration in seconds and peak RSS in MiB.
+        """
+        return {"stage": self.name, **self.counts, "duration": self.duration, "peak_rss_mb": self.peak_rss_mb}
+
+
+def peak_rss_mb() -> float:
+    """
+    :return: Peak resident set size of the current process in MiB.
+    """
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_metrics() -> StageMetrics:
+    """
+    :return: Metrics of the stage being measured, or a detached instance outside of `measure`.
+    """
+    return _current.get() or StageMetrics("untracked")
+
+
+@contextmanager
+def measure(name: str):
+    """
+    Measure a stage, print its summary as JSON and keep it in `COLLECTED` when the block exits.
+
+    :param name: Stage name.
+    :return: The stage's StageMetrics, also available to helpers through `current_metrics`.
+    """
+    metrics = StageMetrics(name)
+    token = _current.set(metrics)
+    start = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics.duration = time.perf_counter() - start
+        metrics.peak_rss_mb = peak_rss_mb()
+        _current.reset(token)
+        COLLECTED.append(metrics.summary())
+        print(f"stage metrics: {json.dumps(metrics.summary())}")
+
+
+def to_openmetrics(summaries: list[dict], prefix: str = "transactions") -> str:
+    """
+    Render stage summaries in the OpenMetrics text format, e.g. for the node exporter's textfile collector.
+
+    :param summaries: Stage summaries, as kept in `COLLECTED`.
+    :param prefix: Prefix of the metric names.
+    :return: OpenMetrics text.
+    """
+    lines = []
+    for counter in StageMetrics.COUNTERS:
+        lines.append(f"# TYPE {prefix}_{counter} counter")
+        lines.extend(f'{prefix}_{counter}_total{{stage="{summary["stage"]}"}} {summary[counter]}'
+                     for summary in summaries)
+    for gauge, key in (("duration_seconds", "duration"), ("peak_rss_mb", "peak_rss_mb")):
+        lines.append(f"# TYPE {prefix}_{gauge} gauge")
+        lines.extend(f'{prefix}_{gauge}{{stage="{summary["stage"]}"}} {summary[key]}' for summary in summaries)
+    lines.append("# EOF")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,149 @@
+import os
+import sys
+import time
+import cProfile
+import functools
+import itertools
+import threading
+import tracemalloc
+from collections import Counter
+
+# directory the profiles are written to, profiling is disabled when unset
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+# seconds between two stack samples, and number of allocation sites in the allocation report
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.005))
+PROFILE_TOP_N = int(os.environ.get("PROFILE_TOP_N", 25))
+
+_active = threading.local()
+# numbers the profiles of this process, so calls within the same second do not overwrite each other
+_calls = itertools.count()
+
+
+class Profiler:
+    """
+    Profile a block with cProfile, a stack sampler and tracemalloc.
+
+    The outputs are written by `write`:
+
+    - `<name>.prof`: cProfile statistics, for pstats, snakeviz or gprof2dot.
+    - `<name>.folded`: sampled stacks in the collapsed format of flamegraph.pl and speedscope.
+    - `<name>.alloc.txt`: peak traced memory and the top allocation sites still alive at the end.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL, top_n: int = PROFILE_TOP_N):
+        """
+        :param interval: Seconds between two stack samples.
+        :param top_n: Number of allocation sites in the allocation report.
+        """
+        self.interval = interval
+        self.top_n = top_n
+        self.profile = cProfile.Profile()
+        self.samples = Counter()
+        self.snapshot = None
+        self.peak = 0
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started_tracing = False
+
+    @staticmethod
+    def active() -> bool:
+        """
+        :return: Whether a Profiler is running in the current thread.
+        """
+        return getattr(_active, "profiler", None) is not None
+
+    def __enter__(self):
+        _active.profiler = self
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        tracemalloc.reset_peak()
+
+        self._sampler = threading.Thread(target=self._sample, args=(threading.get_ident(),), daemon=True)
+        self._sampler.start()
+        self.profile.enable()
+
+        return self
+
+    def __exit__(self, *exc):
+        self.profile.disable()
+        self._stop.set()
+        self._sampler.join()
+
+        self.snapshot = tracemalloc.take_snapshot()
+        self.peak = tracemalloc.get_traced_memory()[1]
+        if self._started_tracing:
+            tracemalloc.stop()
+        _active.profiler = None
+
+    def _sample(self, thread_id: int) -> None:
+        """
+        Record the stack of the profiled thread every `interval` seconds.
+
+        :param thread_id: Identifier of the profiled thread.
+        """
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def write(self, directory: str, name: str) -> list[str]:
+        """
+        Write the profile outputs.
+
+        :param directory: Directory to write to, created if it does not exist.
+        :param name: Base name of the output files.
+        :return: Paths of the written files.
+        """
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, name)
+
+        self.profile.dump_stats(f"{base}.prof")
+
+        with open(f"{base}.folded", "w") as file:
+            file.writelines(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+        # leave out the profiler's own allocations
+        snapshot = self.snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                                tracemalloc.Filter(False, __file__)])
+        with open(f"{base}.alloc.txt", "w") as file:
+            file.write(f"peak traced memory: {self.peak / 2 ** 20:.1f} MiB\n")
+            file.write(f"top {self.top_n} allocation sites alive at the end:\n")
+            file.writelines(f"{stat}\n" for stat in snapshot.statistics("lineno")[:self.top_n])
+
+        paths = [f"{base}.prof", f"{base}.folded", f"{base}.alloc.txt"]
+        print(f"profile written to {', '.join(paths)}")
+
+        return paths
+
+
+def profiled(func):
+    """
+    Decorator profiling every call of `func` when PROFILE_DIR is set.
+
+    The outputs are named after the function, the start time, the process id and a per-process call
+    number. Without PROFILE_DIR the call goes straight through. Calls made while another profiled call
+    is running in the same thread are part of the outer profile.
+
+    :param func: Function to profile.
+    :return: Wrapped function.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not PROFILE_DIR or Profiler.active():
+            return func(*args, **kwargs)
+
+        name = f"{func.__name__}-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{next(_calls)}"
+        profiler = Profiler()
+        try:
+            with profiler:
+                return func(*args, **kwargs)
+        finally:
+            profiler.write(PROFILE_DIR, name)
+
+    return wrapper
@@ -38,8 +38,8 @@ create_transaction_table = \
 users_insert = \
     """
     INSERT INTO 
-    public."user"("uuid", "phoneNumber", "nTransactions")
-    VALUES(%(uuid)s, %(agentPhoneNumber)s, %(nTransactions)s)
+    public."user"("phoneNumber", "nTransactions")
+    VALUES(%(agentPhoneNumber)s, %(nTransactions)s)
     ON CONFLICT ("phoneNumber")
     DO NOTHING
     """
@@ -52,3 +52,73 @@ transaction_insert = \
     VALUES(%(receiverPhoneNumber)s, %(transactionType)s, %(userUuid)s, %(balance)s, %(commission)s, 
            %(amount)s, %(requestTimestamp)s, %(updateTimestamp)s, %(externalId)s)
     """
+
+users_bulk_load = {
+    "staging":
+        """
+        CREATE TEMP TABLE IF NOT EXISTS user_staging AS
+        SELECT "phoneNumber", "nTransactions" FROM public."user"
+        WITH NO DATA
+        """,
+    "copy":
+        """
+        COPY user_staging("phoneNumber", "nTransactions")
+        FROM STDIN WITH (FORMAT csv)
+        """,
+    # inserts the new users and returns the uuids of every staged user, flagged by whether they
+    # were inserted, the rows that already existed are read from the statement's snapshot, which
+    # does not see the CTE's inserts
+    "merge":
+        """
+        WITH inserted AS (
+            INSERT INTO
+            public."user"("phoneNumber", "nTransactions")
+            SELECT "phoneNumber", "nTransactions" FROM user_staging
+            ON CONFLICT ("phoneNumber")
+            DO NOTHING
+            RETURNING "phoneNumber", uuid
+        )
+        SELECT "phoneNumber", uuid, true AS inserted FROM inserted
+        UNION ALL
+        SELECT "phoneNumber", uuid, false AS inserted FROM public."user"
+        WHERE "phoneNumber" IN (SELECT "phoneNumber" FROM user_staging)
+        """,
+    "cleanup": "TRUNCATE user_staging",
+    "columns": ["agentPhoneNumber", "nTransactions"],
+}
+
+users_lookup = \
+    """
+    SELECT "phoneNumber", uuid
+    FROM public."user"
+    WHERE "phoneNumber" = ANY(%(phone_numbers)s)
+    """
+
+transaction_bulk_load = {
+    "staging":
+        """
+        CREATE TEMP TABLE IF NOT EXISTS transaction_staging AS
+        SELECT "mobile", "category", "userUuid", "balance", "commission",
+               "amount", "requestTimestamp", "updateTimestamp", "externalId"
+        FROM public.transaction
+        WITH NO DATA
+        """,
+    "copy":
+        """
+        COPY transaction_staging("mobile", "category", "userUuid", "balance", "commission",
+                                 "amount", "requestTimestamp", "updateTimestamp", "externalId")
+        FROM STDIN WITH (FORMAT csv)
+        """,
+    "merge":
+        """
+        INSERT INTO
+        public.transaction("mobile", "category", "userUuid", "balance", "commission",
+                           "amount", "requestTimestamp", "updateTimestamp", "externalId")
+        SELECT "mobile", "category", "userUuid", "balance", "commission",
+               "amount", "requestTimestamp", "updateTimestamp", "externalId"
+        FROM transaction_staging
+        """,
+    "cleanup": "TRUNCATE transaction_staging",
+    "columns": ["receiverPhoneNumber", "transactionType", "userUuid", "balance", "commission",
+                "amount", "requestTimestamp", "updateTimestamp", "externalId"],
+}
@@ -0,0 +1,214 @@
+import io
+import os
+import csv
+import glob
+import mmap
+import numpy as np
+import pandas as pd
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from metrics import current_metrics
+from schema import read_transactions
+
+# size of the byte ranges a memory-mapped CSV is split into, each is parsed by one worker
+RANGE_BYTES = int(os.environ.get("RANGE_MB", 64)) * 2 ** 20
+
+
+def expand_paths(sources: list[str]) -> list[str]:
+    """
+    Expand the input sources to a sorted list of CSV files.
+
+    :param sources: File paths, directories (every `*.csv` file in them) or glob patterns.
+    :return: List of file paths, without repeats.
+    """
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            paths.extend(sorted(glob.glob(os.path.join(source, "*.csv"))))
+        elif os.path.exists(source):
+            paths.append(source)
+        else:
+            paths.extend(sorted(glob.glob(source)))
+    if not paths:
+        raise FileNotFoundError(f"no CSV files found in {sources}")
+
+    return list(dict.fromkeys(paths))
+
+
+def row_hashes(df: pd.DataFrame) -> np.ndarray:
+    """
+    Hash every row of a frame on all of its columns.
+
+    The hashes depend on the values only, so the same row gets the same hash in every file, also
+    when the category sets of the files differ.
+
+    :param df: Transaction data read with the declared schema.
+    :return: Array of uint64 hashes.
+    """
+    # most columns are close to unique, factorizing them before hashing costs more than it saves
+    return pd.util.hash_pandas_object(df, index=False, categorize=False).to_numpy()
+
+
+def read_deduped(path: str) -> tuple[pd.DataFrame, np.ndarray, int]:
+    """
+    Read one transactions CSV and drop the rows repeated within it.
+
+    :param path: Path of the CSV file.
+    :return: The unique rows, their hashes and the number of rows read.
+    """
+    df = read_transactions(path)
+    hashes = row_hashes(df)
+    unique = ~pd.Series(hashes).duplicated().to_numpy()
+
+    return df[unique], hashes[unique], len(df)
+
+
+def first_seen(hashes: np.ndarray, seen: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Find the rows whose hash was not seen before, neither in `seen` nor earlier in `hashes`.
+
+    :param hashes: Row hashes of the next rows.
+    :param seen: Sorted array of the hashes seen so far.
+    :return: Boolean mask of the new rows and the sorted hashes seen including them.
+    """
+    unique, first = np.unique(hashes, return_index=True)
+    positions = np.searchsorted(seen, unique)
+    new = positions == len(seen)
+    new[~new] = seen[positions[~new]] != unique[~new]
+
+    keep = np.zeros(len(hashes), dtype=bool)
+    keep[first[new]] = True
+
+    return keep, np.insert(seen, positions[new], unique[new])
+
+
+def bounded_map(func, tasks: list[tuple], processes: int = None, window: int = None):
+    """
+    Run `func` over tasks in a process pool, yielding the results in task order.
+
+    At most `window` tasks are submitted ahead of the one being yielded, so the results waiting in
+    memory stay bounded however many tasks there are. With a single process the tasks run inline.
+
+    :param func: Picklable function.
+    :param tasks: Argument tuples of the calls.
+    :param processes: Number of worker processes, defaults to one per CPU and at most one per task.
+    :param window: Maximum number of tasks in flight, defaults to twice the number of processes.
+    :return: Iterator of the results.
+    """
+    processes = min(processes or os.cpu_count(), len(tasks))
+    if processes <= 1:
+        yield from (func(*task) for task in tasks)
+        return
+
+    window = window or 2 * processes
+    executor = ProcessPoolExecutor(processes)
+    pending = deque()
+    try:
+        for task in tasks:
+            pending.append(executor.submit(func, *task))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def iter_transactions(sources: list[str], processes: int = None):
+    """
+    Read transactions CSV files in a process pool and yield their rows that were not seen before.
+
+    Files are parsed concurrently but yielded in path order, so like `drop_duplicates` on the
+    concatenated files the first occurrence of a row is kept. Rows are compared by their 64-bit hash.
+
+    :param sources: File paths, directories or glob patterns, see `expand_paths`.
+    :param processes: Number of worker processes, defaults to one per CPU and at most one per file.
+    :return: Iterator of DataFrames, one per file.
+    """
+    paths = expand_paths(sources)
+    metrics = current_metrics()
+    seen = np.empty(0, dtype=np.uint64)
+
+    results = bounded_map(read_deduped, [(path,) for path in paths], processes)
+    for path, (df, hashes, n_rows) in zip(paths, results):
+        new, seen = first_seen(hashes, seen)
+        metrics.add(rows_in=n_rows, rows_out=new.sum(), bytes_read=os.path.getsize(path))
+        yield df[new]
+
+
+def read_transaction_files(sources: list[str], processes: int = None) -> pd.DataFrame:
+    """
+    Read transactions CSV files into one frame without repeated rows, see `iter_transactions`.
+
+    :param sources: File paths, directories or glob patterns, see `expand_paths`.
+    :param processes: Number of worker processes.
+    :return: Transaction data with the declared schema and a fresh index.
+    """
+    frames = list(iter_transactions(sources, processes))
+    df = pd.concat(frames, ignore_index=True)
+
+    # concat falls back to object when the files have different category sets
+    categories = [column for column, dtype in frames[0].dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+    return df.astype(dict.fromkeys(categories, "category"))
+
+
+def byte_ranges(path: str, range_bytes: int = RANGE_BYTES) -> tuple[list[str], list[tuple[int, int]]]:
+    """
+    Split a CSV file into newline-aligned byte ranges, reading it through a memory map.
+
+    Only the bytes around the split points are touched. Records must not contain quoted newlines,
+    which holds for the transaction exports.
+
+    :param path: Path of the CSV file.
+    :param range_bytes: Approximate size of a range.
+    :return: Column names from the header and `(start, end)` offsets of the ranges after it.
+    """
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        header_end = mm.find(b"\n") + 1 or size
+        columns = next(csv.reader([mm[:header_end].decode().rstrip("\r\n")]))
+
+        ranges = []
+        start = header_end
+        while start < size:
+            newline = mm.find(b"\n", min(start + range_bytes, size) - 1)
+            end = size if newline == -1 else newline + 1
+            ranges.append((start, end))
+            start = end
+
+    return columns, ranges
+
+
+def read_range(path: str, start: int, end: int, columns: list[str]) -> pd.DataFrame:
+    """
+    Parse one byte range of a CSV file with the declared schema.
+
+    The file is memory-mapped, so workers share the operating system's page cache and each one only
+    copies the range it parses.
+
+    :param path: Path of the CSV file.
+    :param start: Offset of the first byte of the range.
+    :param end: Offset past the last byte of the range.
+    :param columns: Column names from the file's header.
+    :return: Transaction data of the range.
+    """
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        buffer = io.BytesIO(mm[start:end])
+
+    return read_transactions(buffer, header=None, names=columns)
+
+
+def range_tasks(sources: list[str], range_bytes: int = RANGE_BYTES) -> list[tuple]:
+    """
+    Split every input file into byte ranges, see `byte_ranges`.
+
+    :param sources: File paths, directories or glob patterns, see `expand_paths`.
+    :param range_bytes: Approximate size of a range.
+    :return: `(path, start, end, columns)` tuples in file order, the arguments of `read_range`.
+    """
+    tasks = []
+    for path in expand_paths(sources):
+        columns, ranges = byte_ranges(path, range_bytes)
+        tasks.extend((path, start, end, columns) for start, end in ranges)
+
+    return tasks
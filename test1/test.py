@@ -1,6 +1,22 @@
+import io
+import os
+import tempfile
 import unittest
+from unittest import mock
+import tracemalloc
+from collections import namedtuple
 import pandas as pd
-from main import get_user_data, get_transaction_data
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from main import get_user_data, get_transaction_data, load_mapped, prepare_transactions, upsert_users
+from utils import frame_records, frame_to_csv, to_epoch_ms
+from schema import format_cents, read_transactions, to_cents
+from engines import pl, transaction_data_arrow, transaction_data_polars
+from benchmark import benchmark_pipeline, sample_transactions_csv
+from metrics import measure, to_openmetrics
+from queries import transaction_bulk_load
+from reader import byte_ranges, iter_transactions, read_range, read_transaction_files
+import profiling
 
 
 class TransactionTest(unittest.TestCase):
@@ -15,7 +31,7 @@ class TransactionTest(unittest.TestCase):
         result = get_user_data(self.df)
         self.assertTrue("agentPhoneNumber" in result.columns)
         self.assertTrue("nTransactions" in result.columns)
-        self.assertTrue("uuid" in result.columns)
+        self.assertFalse("uuid" in result.columns)  # assigned by the user table
         self.assertEqual(len(result), 2)  # ascertain uniqueness
 
     def test_get_transaction_data(self):
@@ -24,6 +40,283 @@ class TransactionTest(unittest.TestCase):
         self.assertTrue("requestTimestamp" in result.columns)
         self.assertTrue("updateTimestamp" in result.columns)
 
+    def test_get_transaction_data_timestamps(self):
+        # Test if the vectorized conversion matches the row-wise strptime conversion
+        expected = [int(datetime.strptime(x, "%Y-%m-%d %H:%M:%S").timestamp() * 1000) for x in self.df["date"]]
+        result = get_transaction_data(self.df)
+        self.assertEqual(list(result["requestTimestamp"]), expected)
+
+
+Column = namedtuple("Column", "name")
+
+
+class FakeCursor:
+    # records the statements and returns the rows of the user table for the merge and lookup
+
+    def __init__(self, stored, new=()):
+        self.stored = stored
+        self.new = set(new)
+        self.description = None
+        self.rowcount = 0
+        self.statements = []
+        self.copies = []
+
+    def execute(self, query, params=None):
+        self.statements.append(query)
+        self.description = None
+        if "SELECT \"phoneNumber\", uuid" in query:
+            self.description = [Column("phoneNumber"), Column("uuid"), Column("inserted")]
+
+    def copy_expert(self, query, buffer):
+        self.copied = buffer.read()
+        self.copies.append(self.copied)
+
+    def fetchall(self):
+        return [(phone_number, uuid, phone_number in self.new) for phone_number, uuid in self.stored.items()]
+
+
+class UpsertUsersTest(unittest.TestCase):
+
+    def test_upsert_users(self):
+        # Test if the uuids come back from the merge itself, without a lookup
+        users = get_user_data(read_transactions("./test_data.csv"))
+        stored = {"220787000654": "uuid-a", "220789778240": "uuid-b"}
+        cur = FakeCursor(stored, new=["220789778240"])
+        with measure("load_users") as metrics:
+            result = upsert_users(cur, users)
+        self.assertEqual((metrics.counts["rows_inserted"], metrics.counts["rows_skipped"]), (1, 1))
+
+        self.assertEqual(dict(zip(result["agentPhoneNumber"], result["uuid"])), stored)
+        self.assertEqual(cur.copied, "220787000654,14\n220789778240,6\n")
+        self.assertFalse(any("ANY" in statement for statement in cur.statements))
+        self.assertEqual(len(get_transaction_data(read_transactions("./test_data.csv")).merge(result)), 20)
+
+
+class MemoryTest(unittest.TestCase):
+
+    def setUp(self):
+        # object string columns, so every allocation of the frame is traced
+        with pd.option_context("future.infer_string", False):
+            self.df = pd.read_csv(io.StringIO(sample_transactions_csv(50_000)))
+        self.frame_bytes = self.df.memory_usage(deep=True).sum()
+
+    def peak_bytes(self, func):
+        tracemalloc.start()
+        try:
+            func(self.df)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_transforms_do_not_mutate_input(self):
+        # Test if the transforms leave the transaction data untouched
+        expected = self.df.copy()
+        get_user_data(self.df)
+        get_transaction_data(self.df)
+        pd.testing.assert_frame_equal(self.df, expected)
+
+    def test_user_data_peak_memory(self):
+        # Test if the user aggregation does not duplicate the transaction data
+        self.assertLess(self.peak_bytes(get_user_data), 0.2 * self.frame_bytes)
+
+    def test_transaction_data_peak_memory(self):
+        # Test if the timestamp transform shares the untouched columns with its input
+        self.assertLess(self.peak_bytes(get_transaction_data), 0.5 * self.frame_bytes)
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def test_sample_transactions_csv(self):
+        # Test if the synthetic data is deterministic and readable with the declared schema
+        text = sample_transactions_csv(1_000, n_agents=10)
+        self.assertEqual(text, sample_transactions_csv(1_000, n_agents=10))
+        df = read_transactions(io.StringIO(text))
+        self.assertEqual(len(df), 1_000)
+        self.assertEqual(df["agentPhoneNumber"].nunique(), 10)
+        self.assertEqual(len(get_user_data(df)), 10)
+
+    def test_benchmark_pipeline(self):
+        # Test if every stage is timed and the database stages are skipped without a cursor
+        result = benchmark_pipeline(1_000)
+        self.assertEqual(list(result["stages"]), ["generate", "read", "dedupe", "user_aggregation",
+                                                  "date_conversion", "hashing", "user_resolution", "load"])
+        self.assertIsNone(result["stages"]["load"])
+        self.assertGreater(result["rows_per_second"], 0)
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_measure(self):
+        # Test if a stage records its counters, duration and peak memory, and renders as OpenMetrics
+        with measure("extract") as metrics:
+            metrics.add(rows_in=3, rows_out=2)
+        summary = metrics.summary()
+        self.assertEqual((summary["rows_in"], summary["rows_out"]), (3, 2))
+        self.assertGreaterEqual(summary["duration"], 0)
+        self.assertGreater(summary["peak_rss_mb"], 0)
+
+        text = to_openmetrics([summary])
+        self.assertIn('transactions_rows_in_total{stage="extract"} 3', text)
+        self.assertTrue(text.endswith("# EOF\n"))
+
+
+class ProfilingTest(unittest.TestCase):
+
+    def test_profiled(self):
+        # Test if a profiled call writes its profile, stack samples and allocation report only when enabled
+        df = pd.read_csv(io.StringIO(sample_transactions_csv(1000)))
+        with tempfile.TemporaryDirectory() as directory:
+            get_user_data(df)
+            self.assertEqual(os.listdir(directory), [])
+
+            with mock.patch.object(profiling, "PROFILE_DIR", directory):
+                get_user_data(df)
+            names = sorted(os.listdir(directory))
+            self.assertEqual([name.split(".", 1)[1] for name in names], ["alloc.txt", "folded", "prof"])
+            self.assertTrue(all(name.startswith("get_user_data-") for name in names))
+            with open(os.path.join(directory, names[0])) as file:
+                self.assertTrue(file.readline().startswith("peak traced memory"))
+
+    def test_profiled_names_unique(self):
+        # Test if calls profiled within the same second write separate files
+        df = pd.read_csv(io.StringIO(sample_transactions_csv(100)))
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch.object(profiling, "PROFILE_DIR", directory):
+                get_user_data(df)
+                get_user_data(df)
+            self.assertEqual(len(os.listdir(directory)), 6)
+
+
+class ReaderTest(unittest.TestCase):
+
+    def test_read_transaction_files(self):
+        # Test if files read in parallel match concatenating them and dropping the repeated rows
+        lines = sample_transactions_csv(1_000, n_agents=10).splitlines(keepends=True)
+        header, rows = lines[0], lines[1:]
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name) for name in ("transactions-1.csv", "transactions-2.csv")]
+            with open(paths[0], "w") as file:
+                file.writelines([header, *rows[:600], *rows[:50]])
+            with open(paths[1], "w") as file:
+                file.writelines([header, *rows[400:]])
+
+            expected = pd.concat(map(read_transactions, paths), ignore_index=True).drop_duplicates(ignore_index=True)
+            expected["transactionType"] = expected["transactionType"].astype("category")
+            with measure("extract") as metrics:
+                result = read_transaction_files([directory], processes=2)
+            pd.testing.assert_frame_equal(result, expected)
+            self.assertEqual((metrics.counts["rows_in"], metrics.counts["rows_out"]), (1_250, 1_000))
+
+            self.assertEqual([len(df) for df in iter_transactions([os.path.join(directory, "*-2.csv"), paths[0]])],
+                             [600, 400])
+
+    def test_byte_ranges(self):
+        # Test if newline-aligned byte ranges of a file parse to the same rows as the whole file
+        columns, ranges = byte_ranges("./test_data.csv", range_bytes=500)
+        self.assertGreater(len(ranges), 1)
+        result = pd.concat([read_range("./test_data.csv", start, end, columns) for start, end in ranges],
+                           ignore_index=True)
+        pd.testing.assert_frame_equal(result, read_transactions("./test_data.csv"))
+
+    def test_load_mapped(self):
+        # Test if loading byte ranges in workers writes the same users and transactions as the whole files
+        lines = sample_transactions_csv(2_000, n_agents=10).splitlines(keepends=True)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "transactions.csv")
+            with open(path, "w") as file:
+                file.writelines([*lines, *lines[1:300]])
+
+            df = read_transaction_files([path])
+            users = get_user_data(df)
+            stored = {phone_number: f"uuid-{i}" for i, phone_number in enumerate(users["agentPhoneNumber"])}
+            expected = prepare_transactions(df, upsert_users(FakeCursor(stored), users))
+
+            cur = FakeCursor(stored)
+            load_mapped(cur, [path], processes=2, range_bytes=16_384)
+
+        self.assertEqual(cur.copies[0], frame_to_csv(users, ["agentPhoneNumber", "nTransactions"]).read())
+        self.assertGreater(len(cur.copies), 3)
+        self.assertEqual("".join(cur.copies[1:]), frame_to_csv(expected, transaction_bulk_load["columns"]).read())
+
+
+class UtilsTest(unittest.TestCase):
+
+    def test_frame_to_csv(self):
+        # Test if rows are written in column order with missing values as NULL and integers kept whole
+        df = pd.DataFrame({"nTransactions": pd.array([2, None], dtype="Int64"),
+                           "agentPhoneNumber": ["220789778240", "220, 1"], "uuid": ["a", "b"]})
+        result = frame_to_csv(df, ["uuid", "agentPhoneNumber", "nTransactions"]).read()
+        self.assertEqual(result, 'a,220789778240,2\nb,"220, 1",\n')
+
+    def test_frame_records(self):
+        # Test if rows are produced as Python values that psycopg2 can adapt
+        df = pd.DataFrame({"requestTimestamp": [1685620661000, 1685629904000], "amount": [1.5, float("nan")],
+                           "nTransactions": pd.array([3, None], dtype="Int64")})
+        result = list(frame_records(df))
+        self.assertEqual(result, [{"requestTimestamp": 1685620661000, "amount": 1.5, "nTransactions": 3},
+                                  {"requestTimestamp": 1685629904000, "amount": None, "nTransactions": None}])
+        self.assertIs(type(result[0]["nTransactions"]), int)
+
+    def test_to_epoch_ms_timezone(self):
+        # Test if explicit timezones resolve DST gaps and overlaps like datetime.timestamp
+        dates = pd.Series(["2023-06-01 11:57:41", "2023-03-12 02:30:00", "2023-11-05 01:30:00"])
+        tz = ZoneInfo("America/New_York")
+        expected = [int(datetime.strptime(x, "%Y-%m-%d %H:%M:%S").replace(tzinfo=tz).timestamp() * 1000)
+                    for x in dates]
+        self.assertEqual(list(to_epoch_ms(dates, "America/New_York")), expected)
+        self.assertEqual(list(to_epoch_ms(dates, "UTC")), [1685620661000, 1678588200000, 1699147800000])
+
+
+class SchemaTest(unittest.TestCase):
+
+    def test_read_transactions(self):
+        # Test if the declared schema is applied and amounts are read as exact cents
+        df = read_transactions("./test_data.csv")
+        self.assertEqual(df["transactionType"].dtype, "category")
+        self.assertEqual(df["agentPhoneNumber"].iloc[0], "220789778240")
+        self.assertEqual(list(df["amount"].iloc[:2]), [400000, 13000000])
+        self.assertEqual(len(get_user_data(df)), 2)
+
+    def test_cents_round_trip(self):
+        # Test if amounts keep their decimal value and round half away from zero
+        values = pd.Series(["4000.0", "110", "-1.5", "12.345", "-0.125", None])
+        cents = to_cents(values)
+        self.assertEqual(list(cents.iloc[:5]), [400000, 11000, -150, 1235, -13])
+        self.assertTrue(pd.isna(cents.iloc[5]))
+        self.assertEqual(list(format_cents(cents).iloc[:5]), ["4000.00", "110.00", "-1.50", "12.35", "-0.13"])
+
+
+class EngineParityTest(unittest.TestCase):
+
+    def assert_parity(self, engine, reader):
+        # Test if an engine produces the same frames as the pandas reference implementation
+        expected_users = get_user_data(reader("./test_data.csv"))
+        expected_transactions = get_transaction_data(reader("./test_data.csv"))
+
+        pd.testing.assert_frame_equal(get_user_data(reader("./test_data.csv"), engine), expected_users)
+        pd.testing.assert_frame_equal(get_transaction_data(reader("./test_data.csv"), engine), expected_transactions)
+
+    def test_arrow_parity(self):
+        self.assert_parity("arrow", pd.read_csv)
+        self.assert_parity("arrow", read_transactions)
+
+    @unittest.skipIf(pl is None, "polars is not installed")
+    def test_polars_parity(self):
+        self.assert_parity("polars", pd.read_csv)
+        self.assert_parity("polars", read_transactions)
+
+    def test_daylight_saving_parity(self):
+        # Test if the engines resolve DST gaps and overlaps like the reference conversion
+        df = pd.DataFrame({"date": ["2023-03-12 02:30:00", "2023-11-05 01:30:00", "2023-06-01 12:57:41"]})
+        expected = list(to_epoch_ms(df["date"], "America/New_York"))
+        self.assertEqual(list(transaction_data_arrow(df, "America/New_York")["date"]), expected)
+        if pl is not None:
+            self.assertEqual(list(transaction_data_polars(df, "America/New_York")["date"]), expected)
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            get_user_data(pd.read_csv("./test_data.csv"), "spark")
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,14 @@
+import io
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
 import psycopg2
 from psycopg2.extras import execute_batch
 import datetime
+from zoneinfo import ZoneInfo
+from metrics import current_metrics
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
 
 def establish_connection(host, port, db, user, password):
@@ -32,6 +40,29 @@ def establish_connection(host, port, db, user, password):
     return cur
 
 
+@contextmanager
+def database_cursor(host, port, db, user, password):
+    """
+    Open a cursor with `establish_connection` and close it and its connection when the block exits.
+
+    :param host: PostgreSQL host address
+    :param port:  PostgreSQL port number. Default is 5432.
+    :param db:  PostgreSQL database name.
+    :param user:  PostgreSQL database user.
+    :param password: PostgreSQL database password.
+    :return: Cursor for executing SQL queries.
+    """
+    cur = establish_connection(host=host, port=port, db=db, user=user, password=password)
+    if cur is None:
+        raise ConnectionError(f"could not connect to {db} database")
+    try:
+        yield cur
+    finally:
+        cur.close()
+        cur.connection.close()
+        print(f"closed connection to {db} database")
+
+
 def run_sql_query(cur, query):
     """
     Execute a SQL query using the provided cursor.
@@ -48,13 +79,13 @@ def run_sql_query(cur, query):
         print(e)
 
 
-def write_batch_to_db(cur, query: str, data: list[dict]) -> None:
+def write_batch_to_db(cur, query: str, data) -> None:
     """
     This function uses psycopg2's `execute_batch` method to efficiently write a batch of data to the database.
 
     :param cur: Cursor for executing SQL queries.
     :param query: SQL query for the batch insert.
-    :param data: List of dictionaries, where each dictionary represents a row of data to be inserted.
+    :param data: Iterable of dictionaries, where each dictionary represents a row of data to be inserted.
     :return:
     """
     start = datetime.datetime.now()
@@ -69,3 +100,140 @@ def write_batch_to_db(cur, query: str, data: list[dict]) -> None:
         end = datetime.datetime.now() - start
         print(f"Time taken: {end}")
 
+
+
+def frame_to_csv(df: pd.DataFrame, columns: list[str]) -> io.StringIO:
+    """
+    Serialize a DataFrame into an in-memory CSV buffer that can be streamed with `COPY ... FROM STDIN`.
+
+    The columns are written directly by pandas' CSV writer, so the rows never exist as Python
+    objects. Integers (epoch timestamps, counts) are written without a decimal point and missing
+    values are written as NULL.
+
+    :param df: DataFrame holding the rows.
+    :param columns: Columns to write, in the column order expected by the COPY statement.
+    :return: CSV buffer positioned at the start.
+    """
+    buffer = io.StringIO()
+    df.to_csv(buffer, columns=columns, header=False, index=False, lineterminator="\n")
+    buffer.seek(0)
+
+    return buffer
+
+
+def frame_records(df: pd.DataFrame):
+    """
+    Iterate over the rows of a DataFrame as dictionaries of Python values, for `execute_batch`.
+
+    Rows are produced one at a time, numpy scalars are converted to their Python equivalent and
+    missing values to None, so psycopg2 can adapt every value.
+
+    :param df: DataFrame holding the rows.
+    :return: Iterator of dictionaries keyed by column name.
+    """
+    columns = list(df.columns)
+    for row in df.itertuples(index=False, name=None):
+        yield {column: to_python(value) for column, value in zip(columns, row)}
+
+
+def to_python(value):
+    """
+    Convert a DataFrame cell to a value psycopg2 can adapt.
+
+    :param value: Cell value.
+    :return: The value as a Python scalar, None if it is missing.
+    """
+    if value is None or value is pd.NA or value != value:
+        return None
+
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def copy_batch_to_db(cur, bulk_load: dict, df: pd.DataFrame, fallback_query: str = None) -> list[tuple]:
+    """
+    Bulk load a batch of data by streaming it into a staging table with `COPY ... FROM STDIN`
+    and merging it into the target table in a single set-based statement.
+
+    If the COPY or the merge fails and a `fallback_query` is given, the batch is written
+    with `write_batch_to_db` instead. The rows inserted and the rows skipped by `ON CONFLICT` are
+    added to the current stage metrics; a merge returning rows reports insertions with a trailing
+    `inserted` column.
+
+    :param cur: Cursor for executing SQL queries.
+    :param bulk_load: Dictionary with the `staging`, `copy`, `merge` and `cleanup` SQL statements
+        and the `columns` to write (see queries.py).
+    :param df: DataFrame holding the rows to be inserted.
+    :param fallback_query: SQL query for the `execute_batch` insert path.
+    :return: Rows returned by the merge statement, empty if it returns none or the fallback was used.
+    """
+    start = datetime.datetime.now()
+    returned = []
+    try:
+        cur.execute(bulk_load["staging"])
+        cur.execute(bulk_load["cleanup"])
+        cur.copy_expert(bulk_load["copy"], frame_to_csv(df, bulk_load["columns"]))
+        cur.execute(bulk_load["merge"])
+        if cur.description:
+            returned = cur.fetchall()
+            inserted = sum(row[-1] for row in returned) if cur.description[-1].name == "inserted" else len(returned)
+        else:
+            inserted = max(cur.rowcount, 0)
+        cur.execute(bulk_load["cleanup"])
+    except psycopg2.Error as e:
+        print("error bulk loading to table")
+        print(e)
+        if fallback_query:
+            print("falling back to batch insert")
+            write_batch_to_db(cur, fallback_query, frame_records(df))
+    else:
+        elapsed = (datetime.datetime.now() - start).total_seconds()
+        rate = len(df) / elapsed if elapsed else float(len(df))
+        print(f"copy insert complete: {len(df)} rows in {elapsed:.2f}s ({rate:.0f} rows/sec), "
+              f"{inserted} inserted, {len(df) - inserted} skipped")
+        current_metrics().add(rows_inserted=inserted, rows_skipped=len(df) - inserted)
+
+    return returned
+
+
+def local_offsets_ms(minutes, tz=None) -> list[int]:
+    """
+    Resolve the UTC offset of wall clock minutes with `datetime.timestamp`.
+
+    :param minutes: Wall clock minutes, as epoch milliseconds of the naive datetimes.
+    :param tz: Timezone name or tzinfo the minutes are recorded in. Default is the local timezone.
+    :return: List of offsets in milliseconds to add to the naive epoch milliseconds.
+    """
+    epoch = datetime.datetime(1970, 1, 1)
+    tzinfo = ZoneInfo(tz) if isinstance(tz, str) else tz
+
+    offsets = []
+    for minute in minutes:
+        wall = epoch + datetime.timedelta(milliseconds=int(minute))
+        offsets.append(int(wall.replace(tzinfo=tzinfo).timestamp() * 1000) - int(minute))
+
+    return offsets
+
+
+def to_epoch_ms(dates: pd.Series, tz=None) -> pd.Series:
+    """
+    Convert date strings in `DATE_FORMAT` to epoch milliseconds.
+
+    This is a vectorized equivalent of
+    `int(datetime.strptime(x, DATE_FORMAT).timestamp() * 1000)`: the dates are parsed in one pass
+    and the UTC offset is resolved once per distinct minute with `datetime.timestamp`, so DST
+    gaps and overlaps are handled exactly like the row-wise conversion.
+
+    :param dates: Series of date strings.
+    :param tz: Timezone name or tzinfo the dates are recorded in. Default is the local timezone,
+        which is what `datetime.timestamp` assumes for naive datetimes.
+    :return: Series of int64 epoch milliseconds.
+    """
+    epoch = pd.Timestamp("1970-01-01")
+    millisecond = pd.Timedelta(milliseconds=1)
+
+    wall = (pd.to_datetime(dates, format=DATE_FORMAT) - epoch) // millisecond
+    minutes = wall // 60_000 * 60_000
+    unique_minutes = minutes.unique()
+    offsets = pd.Series(local_offsets_ms(unique_minutes, tz), index=unique_minutes, dtype="int64")
+
+    return wall + minutes.map(offsets)
@@ -1,21 +1,27 @@
 import os
-import boto3
 import datetime as dt
-from sqlalchemy import create_engine
 from pendulum import datetime, duration
+from airflow.models.param import Param
 from airflow.operators.empty import EmptyOperator
 from airflow.operators.python import get_current_context
 from include.helpers.slack import send_notification as slack_notify
-# from include.helpers.utils import establish_connection
+from include.helpers.s3_sensor import S3FileSensor
 from include.sql.daily_transaction_sql import (
-    users_insert,
-    transaction_insert
+    transaction_insert,
+    transaction_bulk_load
 )
 from include.scripts.daily_transaction_callables import (
     get_transaction_data,
     write_data_to_db,
+    write_user_data,
     transform_user_data,
-    transform_transaction_data
+    transform_transaction_data,
+    stream_transaction_data,
+    check_watermark,
+    record_watermark,
+    split_transaction_data,
+    verify_shards,
+    clean_up_handoff
 
 )
 from airflow.decorators import (
@@ -32,6 +38,23 @@ user = str(os.environ.get("USER"))
 port = str(os.environ.get("PORT"))
 db = os.environ.get("DB")
 password = os.environ.get("PASS")
+# rows per chunk for the streaming mode, 0 keeps the batch task groups
+CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", 0))
+# worker processes for hashing the rowIds of large files, 0 hashes in the task process
+HASH_PROCESSES = int(os.environ.get("HASH_PROCESSES", 0))
+# concurrent connections writing the transaction table, and rows per batch for each of them
+WRITE_WORKERS = int(os.environ.get("WRITE_WORKERS", 1))
+WRITE_BATCH_SIZE = int(os.environ.get("WRITE_BATCH_SIZE", 50_000))
+# skip files already loaded and send only new rows, based on the watermarks of previous loads
+INCREMENTAL = os.environ.get("INCREMENTAL", "false").lower() == "true"
+# target rows per mapped transform/load shard, and the most shards a day is split into
+SHARD_ROWS = int(os.environ.get("SHARD_ROWS", 500_000))
+MAX_SHARDS = int(os.environ.get("MAX_SHARDS", 16))
+# dataframe backend of the transaction transform: pandas, arrow or polars
+TRANSFORM_ENGINE = os.environ.get("TRANSFORM_ENGINE", "pandas")
+
+# uuids handed back by the user upsert, an empty string makes the transform query the user table
+USER_MAP_REF = "{{ ti.xcom_pull(task_ids='write_to_user.write_user_data_to_user_table') or '' }}"
 
 database_obj = {
     "host": host,
@@ -40,7 +63,6 @@ database_obj = {
     "db": db,
     "password": password,
 }
-database_uri = f"postgresql://{user}:{password}@{host}:{port}/{db}"
 
 
 @dag(
@@ -54,6 +76,10 @@ database_uri = f"postgresql://{user}:{password}@{host}:{port}/{db}"
         "retry_delay": duration(
             minutes=30
         )
+    },
+    # trigger with {"profile": true} to profile the run's tasks, see include/helpers/profiling.py
+    params={
+        "profile": Param(False, type="boolean")
     }
 
 )
@@ -66,28 +92,6 @@ def daily_transaction_to_db():
     start = EmptyOperator(task_id="start_task")
     end = EmptyOperator(task_id="end_task", trigger_rule="none_failed")
 
-    @task(retries=7)
-    def check_file_availability(run_date: str):
-        """
-        Extract task to check file availability.
-
-        :param run_date: The date for which the data is being processed.
-        """
-
-        # prev_file_date = str((dt.datetime.strptime(run_date, "%Y-%m-%d") - dt.timedelta(days=1)).strftime("%Y-%m-%d"))
-        print("run for: ",run_date)
-        s3 = boto3.resource("s3")
-
-        context = get_current_context()
-        ti = context["ti"]
-
-        try:
-            s3.Object(BUCKET, BUCKET_KEY.format(run_date)).get()
-
-        except Exception as e:
-            ti.xcom_push("check_file_error", str(e))
-            raise e
-
     @task(trigger_rule="one_failed")
     def send_slack_notification():
         """
@@ -104,69 +108,113 @@ def daily_transaction_to_db():
         slack_notify(SLACK_WEBHOOK, dag_id, dag_url, title, message)
 
     @task_group()
-    def write_to_user(run_date: str):
+    def write_to_user(transaction_data: str):
         """
         Transform task group for processing user data.
 
-        :param run_date: The date for which the data is being processed.
+        :param transaction_data: Handoff reference to the day's transaction data.
         """
-        s3_path = f"{BUCKET}/{BUCKET_KEY}"
-
-        # Get new user transaction data
-        transaction_data = get_transaction_data.override(
-            task_id="get_new_user_transaction",
-            trigger_rule="none_failed"
-        )(run_date, s3_path)
 
         # Transform user data
         ready_user_data = transform_user_data.override(
             trigger_rule="none_failed"
         )(transaction_data)
 
-        # Write user data to the user table
-        write_user_data = write_data_to_db.override(
+        # Write user data to the user table, the upsert hands back every agent's uuid
+        user_uuids = write_user_data.override(
             task_id="write_user_data_to_user_table",
             trigger_rule="none_failed"
-        )(database_obj, users_insert, ready_user_data)
+        )(database_obj, ready_user_data)
 
-        transaction_data >> ready_user_data >> write_user_data
+        ready_user_data >> user_uuids
 
     @task_group()
-    def write_to_transactions(run_date):
+    def write_to_transactions(transaction_data: str):
         """
         Transform task group for processing transaction data.
 
-        :param run_date: The date for which the data is being processed.
+        :param transaction_data: Handoff reference to the day's transaction data.
         """
 
-        s3_path = f"{BUCKET}/{BUCKET_KEY}"
-
-        # Get new transactions data
-        transaction_data = get_transaction_data.override(
-            task_id="get_new_transactions",
+        # Split large days into shards, transformed and written by mapped tasks
+        shards = split_transaction_data.override(
             trigger_rule="none_failed"
-        )(run_date, s3_path)
+        )(transaction_data, SHARD_ROWS, MAX_SHARDS)
 
         # Transform transaction data
         ready_transaction_data = transform_transaction_data.override(
             trigger_rule="none_failed"
-        )(transaction_data, database_uri)
+        ).partial(
+            database_obj=database_obj, hash_processes=HASH_PROCESSES, engine=TRANSFORM_ENGINE,
+            user_map_ref=USER_MAP_REF
+        ).expand(data_ref=shards)
 
         # Write transaction data to the transaction table
         write_transaction_data = write_data_to_db.override(
             task_id="write_transaction_data_to_transaction_table",
             trigger_rule="none_failed"
-        )(database_obj, transaction_insert, ready_transaction_data)
-
-        transaction_data >> ready_transaction_data >> write_transaction_data
+        ).partial(
+            database_obj=database_obj, query=transaction_insert, bulk_load=transaction_bulk_load,
+            workers=WRITE_WORKERS, batch_size=WRITE_BATCH_SIZE
+        ).expand(data_ref=ready_transaction_data)
 
-    check_file = check_file_availability(today_run_date)
+        # Check that the shards add up to the day's data
+        verify_transaction_data = verify_shards.override(
+            trigger_rule="none_failed"
+        )(transaction_data, shards, ready_transaction_data, write_transaction_data)
+
+        shards >> ready_transaction_data >> write_transaction_data >> verify_transaction_data
+
+    # the file is due at 9 AM, wait on the triggerer until 1 PM before failing
+    check_file = S3FileSensor(
+        task_id="check_file_availability",
+        bucket=BUCKET,
+        key=BUCKET_KEY.format(today_run_date),
+        timeout=duration(hours=4).total_seconds(),
+        poke_interval=duration(minutes=10).total_seconds(),
+        retries=0
+    )
     send_notification = send_slack_notification()
-    write_to_user = write_to_user(today_run_date)
-    write_to_transactions = write_to_transactions(today_run_date)
 
     start >> check_file >> send_notification >> end
-    check_file >> write_to_user >> write_to_transactions >> end
+
+    if INCREMENTAL:
+        check_loaded = check_watermark(today_run_date, f"{BUCKET}/{BUCKET_KEY}", database_obj)
+        check_file >> check_loaded
+        load_start = check_loaded
+    else:
+        load_start = check_file
+
+    if CHUNK_SIZE:
+        stream_transactions = stream_transaction_data.override(
+            trigger_rule="none_failed"
+        )(today_run_date, f"{BUCKET}/{BUCKET_KEY}", database_obj, CHUNK_SIZE, INCREMENTAL)
+
+        load_start >> stream_transactions
+        load_end = stream_transactions
+    else:
+        # read the file once and share it between the user and transaction task groups
+        transaction_data = get_transaction_data.override(
+            task_id="get_transactions",
+            trigger_rule="none_failed"
+        )(today_run_date, f"{BUCKET}/{BUCKET_KEY}", database_obj if INCREMENTAL else None)
+        write_to_user = write_to_user(transaction_data)
+        write_to_transactions = write_to_transactions(transaction_data)
+
+        load_start >> transaction_data >> write_to_user >> write_to_transactions
+        load_end = write_to_transactions
+
+    if INCREMENTAL:
+        save_watermark = record_watermark(
+            database_obj,
+            "stream_transaction_data" if CHUNK_SIZE else "get_transactions"
+        )
+        load_end >> save_watermark
+        load_end = save_watermark
+
+    # only runs when every load succeeded, a failed run keeps its handoff files for retries
+    clean_up = clean_up_handoff()
+    load_end >> clean_up >> end
 
 
 daily_transaction_to_db()
@@ -0,0 +1,188 @@
+import os
+import math
+import fcntl
+import struct
+from contextlib import contextmanager
+import numpy as np
+
+# file holding the Bloom filter of loaded rowIds, the pre-dedup is disabled when unset
+ROWID_BLOOM_PATH = os.environ.get("ROWID_BLOOM_PATH")
+# number of rowIds the filter is sized for, and its false-positive rate at that size; the file takes about
+# 1.8 bytes per rowId of capacity at 0.1% (90 MB by default) and is rewritten once per run
+ROWID_BLOOM_CAPACITY = int(os.environ.get("ROWID_BLOOM_CAPACITY", 50_000_000))
+ROWID_BLOOM_FP_RATE = float(os.environ.get("ROWID_BLOOM_FP_RATE", 0.001))
+
+MAGIC = b"RIDBLOOM"
+# magic, number of bits, number of hashes, number of added rowIds
+HEADER = struct.Struct("<8sQIQ")
+
+
+class RowIdBloomFilter:
+    """
+    Bloom filter of rowId MD5 hex digests, stored as a flat bit array behind a small header.
+
+    The two 64-bit halves of each digest are already uniformly distributed, so the filter uses
+    them directly for double hashing instead of hashing the rowIds again.
+    """
+
+    def __init__(self, bits: np.ndarray, n_hashes: int, count: int = 0):
+        """
+        :param bits: Bit array as uint8, may be a memory map.
+        :param n_hashes: Number of bit positions per rowId.
+        :param count: Number of rowIds already added.
+        """
+        self.bits = bits
+        self.n_bits = len(bits) * 8
+        self.n_hashes = n_hashes
+        self.count = count
+
+    @classmethod
+    def create(cls, capacity: int = ROWID_BLOOM_CAPACITY, fp_rate: float = ROWID_BLOOM_FP_RATE):
+        """
+        Create an empty filter.
+
+        :param capacity: Number of rowIds the filter is sized for.
+        :param fp_rate: False-positive rate once `capacity` rowIds were added.
+        :return: RowIdBloomFilter
+        """
+        n_bits = math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)
+        n_hashes = max(1, round(n_bits / capacity * math.log(2)))
+
+        return cls(np.zeros(math.ceil(n_bits / 8), dtype=np.uint8), n_hashes)
+
+    @classmethod
+    def empty_like(cls, other):
+        """
+        Create an empty filter with the size and number of hashes of another one, so they can be merged.
+
+        :param other: RowIdBloomFilter
+        :return: RowIdBloomFilter
+        """
+        return cls(np.zeros(len(other.bits), dtype=np.uint8), other.n_hashes)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        """
+        Load a filter written by `save`.
+
+        :param path: Path of the filter file.
+        :param mmap: Whether to memory-map the bit array instead of reading it into memory.
+        :return: RowIdBloomFilter
+        """
+        with open(path, "rb") as f:
+            magic, n_bits, n_hashes, count = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a rowId Bloom filter")
+
+        if mmap:
+            bits = np.memmap(path, dtype=np.uint8, mode="c", offset=HEADER.size, shape=(n_bits // 8,))
+        else:
+            bits = np.fromfile(path, dtype=np.uint8, offset=HEADER.size)
+
+        return cls(bits, n_hashes, count)
+
+    def save(self, path: str) -> None:
+        """
+        Write the filter, replacing the file atomically.
+
+        :param path: Path of the filter file.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        partial_path = f"{path}.{os.getpid()}.part"
+        with open(partial_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, self.n_bits, self.n_hashes, self.count))
+            np.asarray(self.bits).tofile(f)
+        os.replace(partial_path, path)
+
+    def _positions(self, row_ids: list[str]) -> np.ndarray:
+        digests = np.frombuffer(bytes.fromhex("".join(row_ids)), dtype=">u8").reshape(-1, 2).astype(np.uint64)
+        h1, h2 = digests[:, :1], digests[:, 1:] | np.uint64(1)
+        rounds = np.arange(self.n_hashes, dtype=np.uint64)
+
+        # uint64 arithmetic wraps around, which is fine for hashing
+        return (h1 + rounds * h2) % np.uint64(self.n_bits)
+
+    def add_many(self, row_ids: list[str]) -> None:
+        """
+        Add rowIds to the filter.
+
+        :param row_ids: MD5 hex digests.
+        """
+        if not len(row_ids):
+            return
+
+        positions = self._positions(row_ids).ravel()
+        masks = np.left_shift(np.uint8(1), (positions & np.uint64(7)).astype(np.uint8))
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3), masks)
+        self.count += len(row_ids)
+
+    def update(self, other) -> None:
+        """
+        Add the rowIds of another filter of the same size.
+
+        :param other: RowIdBloomFilter, e.g. one created with `empty_like` holding the additions of a task.
+        """
+        if (other.n_bits, other.n_hashes) != (self.n_bits, self.n_hashes):
+            raise ValueError("rowId Bloom filters of different sizes cannot be merged")
+
+        np.bitwise_or(self.bits, other.bits, out=self.bits)
+        self.count += other.count
+
+    def contains_many(self, row_ids: list[str]) -> np.ndarray:
+        """
+        Test rowIds for membership.
+
+        :param row_ids: MD5 hex digests.
+        :return: Boolean array, False means the rowId was definitely never added.
+        """
+        if not len(row_ids):
+            return np.zeros(0, dtype=bool)
+
+        positions = self._positions(row_ids)
+        masks = np.left_shift(np.uint8(1), (positions & np.uint64(7)).astype(np.uint8))
+
+        return ((self.bits[positions >> np.uint64(3)] & masks) != 0).all(axis=1)
+
+    def false_positive_rate(self) -> float:
+        """
+        :return: Expected false-positive rate for the number of rowIds added so far.
+        """
+        return (1 - math.exp(-self.n_hashes * self.count / self.n_bits)) ** self.n_hashes
+
+
+def get_row_id_filter():
+    """
+    Load the rowId filter configured with the ROWID_BLOOM_PATH environment variable.
+
+    :return: RowIdBloomFilter (a new empty one if the file does not exist yet), or None when
+        the filter is not configured.
+    """
+    if not ROWID_BLOOM_PATH:
+        return None
+    if not os.path.exists(ROWID_BLOOM_PATH):
+        return RowIdBloomFilter.create()
+
+    return RowIdBloomFilter.load(ROWID_BLOOM_PATH)
+
+
+@contextmanager
+def row_id_filter_lock(path: str = None):
+    """
+    Hold an exclusive lock on the filter file, so concurrent tasks do not overwrite each other's additions.
+
+    :param path: Path of the filter file, defaults to ROWID_BLOOM_PATH.
+    """
+    path = path or ROWID_BLOOM_PATH
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    with open(f"{path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,123 @@
+import datetime
+from zoneinfo import ZoneInfo
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# dataframe backends the transforms can run on, pandas is the reference implementation
+ENGINES = ("pandas", "arrow", "polars")
+
+
+def check_engine(engine: str) -> None:
+    """
+    Make sure a transform engine is known and its library is installed.
+
+    :param engine: One of `ENGINES`.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"unknown engine {engine!r}, expected one of {ENGINES}")
+    if engine == "polars" and pl is None:
+        raise ImportError("the polars engine needs the polars package installed")
+
+
+def local_offsets_ms(minutes, tz=None) -> list[int]:
+    """
+    Resolve the UTC offset of wall clock minutes with `datetime.timestamp`.
+
+    :param minutes: Wall clock minutes, as epoch milliseconds of the naive datetimes.
+    :param tz: Timezone name or tzinfo the minutes are recorded in. Default is the local timezone.
+    :return: List of offsets in milliseconds to add to the naive epoch milliseconds.
+    """
+    epoch = datetime.datetime(1970, 1, 1)
+    tzinfo = ZoneInfo(tz) if isinstance(tz, str) else tz
+
+    offsets = []
+    for minute in minutes:
+        wall = epoch + datetime.timedelta(milliseconds=int(minute))
+        offsets.append(int(wall.replace(tzinfo=tzinfo).timestamp() * 1000) - int(minute))
+
+    return offsets
+
+
+def epoch_ms_pandas(dates: pd.Series, tz=None) -> pd.Series:
+    """
+    Convert date strings in `DATE_FORMAT` to epoch milliseconds with pandas.
+
+    :param dates: Series of date strings.
+    :param tz: Timezone name or tzinfo the dates are recorded in. Default is the local timezone.
+    :return: Series of int64 epoch milliseconds.
+    """
+    epoch = pd.Timestamp("1970-01-01")
+    millisecond = pd.Timedelta(milliseconds=1)
+
+    wall = (pd.to_datetime(dates, format=DATE_FORMAT) - epoch) // millisecond
+    minutes = wall // 60_000 * 60_000
+    unique_minutes = minutes.unique()
+    offsets = pd.Series(local_offsets_ms(unique_minutes, tz), index=unique_minutes, dtype="int64")
+
+    return wall + minutes.map(offsets)
+
+
+def epoch_ms_arrow(dates: pd.Series, tz=None) -> pd.Series:
+    """
+    Arrow compute version of `epoch_ms_pandas`.
+
+    :param dates: Series of date strings.
+    :param tz: Timezone name or tzinfo the dates are recorded in. Default is the local timezone.
+    :return: Series of int64 epoch milliseconds.
+    """
+    wall = pc.strptime(pa.array(dates, pa.string()), format=DATE_FORMAT, unit="ms")
+    minutes = pc.floor_temporal(wall, unit="minute")
+    unique_minutes = pc.unique(minutes)
+    offsets = pa.array(local_offsets_ms(unique_minutes.cast(pa.int64()).to_numpy(), tz), pa.int64())
+    epoch_ms = pc.add(wall.cast(pa.int64()), offsets.take(pc.index_in(minutes, value_set=unique_minutes)))
+
+    return pd.Series(epoch_ms.to_numpy(), index=dates.index, name=dates.name)
+
+
+def epoch_ms_polars(dates: pd.Series, tz=None) -> pd.Series:
+    """
+    Polars version of `epoch_ms_pandas`.
+
+    :param dates: Series of date strings.
+    :param tz: Timezone name or tzinfo the dates are recorded in. Default is the local timezone.
+    :return: Series of int64 epoch milliseconds.
+    """
+    frame = pl.from_pandas(dates.to_frame("date")).lazy().select(
+        pl.col("date").str.strptime(pl.Datetime("ms"), DATE_FORMAT).dt.epoch("ms").alias("wall"),
+    ).with_columns(
+        (pl.col("wall") // 60_000 * 60_000).alias("minute"),
+    ).collect()
+    unique_minutes = frame["minute"].unique()
+    offsets = dict(zip(unique_minutes.to_list(), local_offsets_ms(unique_minutes.to_numpy(), tz)))
+    epoch_ms = frame["wall"] + frame["minute"].replace_strict(offsets, return_dtype=pl.Int64)
+
+    return pd.Series(epoch_ms.to_numpy(), index=dates.index, name=dates.name)
+
+
+def epoch_ms(dates: pd.Series, tz=None, engine: str = "pandas") -> pd.Series:
+    """
+    Convert date strings in `DATE_FORMAT` to epoch milliseconds on the selected engine.
+
+    Every engine matches `int(datetime.datetime.strptime(x, DATE_FORMAT).timestamp() * 1000)`, the UTC
+    offset is resolved once per distinct minute so DST gaps and overlaps behave like the row-wise
+    conversion.
+
+    :param dates: Series of date strings.
+    :param tz: Timezone name or tzinfo the dates are recorded in. Default is the local timezone.
+    :param engine: One of `ENGINES`.
+    :return: Series of int64 epoch milliseconds.
+    """
+    check_engine(engine)
+    if engine == "arrow":
+        return epoch_ms_arrow(dates, tz)
+    if engine == "polars":
+        return epoch_ms_polars(dates, tz)
+
+    return epoch_ms_pandas(dates, tz)
@@ -0,0 +1,133 @@
+import os
+import time
+import shutil
+import datetime as dt
+import pandas as pd
+import awswrangler as wr
+import pyarrow.parquet as pq
+from pyarrow.fs import S3FileSystem
+from airflow.operators.python import get_current_context
+
+# local directory, shared mount or s3:// prefix where intermediate task results are written.
+# With more than one worker this must be storage every worker can read.
+HANDOFF_PATH = os.environ.get("HANDOFF_PATH", "/tmp/airflow_handoff")
+# files of runs that did not clean up after themselves, e.g. failed runs, are deleted after this many days
+HANDOFF_RETENTION_DAYS = float(os.environ.get("HANDOFF_RETENTION_DAYS", 7))
+
+
+def run_prefix(dag_id: str, run_id: str, base_path: str = HANDOFF_PATH) -> str:
+    """
+    Build the location holding the intermediate results of a dag run.
+
+    :param dag_id: Dag id.
+    :param run_id: Run id.
+    :param base_path: Local directory or s3:// prefix for the handoff files.
+    :return: Directory or s3:// prefix of the run.
+    """
+    run_id = run_id.replace(":", "_").replace("+", "_")
+
+    return f"{base_path.rstrip('/')}/{dag_id}/{run_id}"
+
+
+def handoff_path(name: str, base_path: str = HANDOFF_PATH) -> str:
+    """
+    Build the location of an intermediate result for the running task.
+
+    The path is derived from the dag, run and task ids, so a retried task overwrites its own
+    previous output instead of leaving a new file behind.
+
+    :param name: Name of the result within the task.
+    :param base_path: Local directory or s3:// prefix for the handoff files.
+    :return: Path of the Parquet file.
+    """
+    context = get_current_context()
+    ti = context["ti"]
+    task_id = ti.task_id if ti.map_index < 0 else f"{ti.task_id}-{ti.map_index}"
+
+    return f"{run_prefix(ti.dag_id, ti.run_id, base_path)}/{task_id}/{name}.parquet"
+
+
+def spill(df: pd.DataFrame, name: str = "data", base_path: str = HANDOFF_PATH) -> str:
+    """
+    Write a DataFrame as a compressed Parquet file and return a reference small enough for XCom.
+
+    :param df: DataFrame to hand off to a downstream task.
+    :param name: Name of the result within the task.
+    :param base_path: Local directory or s3:// prefix for the handoff files.
+    :return: Path of the written file.
+    """
+    path = handoff_path(name, base_path)
+    if path.startswith("s3://"):
+        wr.s3.to_parquet(df, path, index=False, compression="snappy")
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_parquet(path, index=False, compression="snappy")
+    print(f"handed off {len(df)} rows to {path}")
+
+    return path
+
+
+def load(ref: str, columns: list[str] = None) -> pd.DataFrame:
+    """
+    Read a DataFrame written by `spill`.
+
+    :param ref: Path returned by `spill`.
+    :param columns: Optional subset of columns to read.
+    :return: The handed off DataFrame.
+    """
+    if ref.startswith("s3://"):
+        return wr.s3.read_parquet(ref, columns=columns)
+
+    return pd.read_parquet(ref, columns=columns)
+
+
+def count_rows(ref: str) -> int:
+    """
+    Count the rows of a DataFrame written by `spill` from the Parquet footer, without reading the data.
+
+    :param ref: Path returned by `spill`.
+    :return: Number of rows.
+    """
+    if ref.startswith("s3://"):
+        return pq.read_metadata(ref.removeprefix("s3://"), filesystem=S3FileSystem()).num_rows
+
+    return pq.read_metadata(ref).num_rows
+
+
+def remove_run(dag_id: str, run_id: str, base_path: str = HANDOFF_PATH) -> None:
+    """
+    Delete every intermediate result of a dag run.
+
+    :param dag_id: Dag id.
+    :param run_id: Run id.
+    :param base_path: Local directory or s3:// prefix for the handoff files.
+    """
+    prefix = run_prefix(dag_id, run_id, base_path)
+    if prefix.startswith("s3://"):
+        wr.s3.delete_objects(f"{prefix}/")
+    else:
+        shutil.rmtree(prefix, ignore_errors=True)
+    print(f"removed handoff files under {prefix}")
+
+
+def prune(dag_id: str, max_age_days: float = HANDOFF_RETENTION_DAYS, base_path: str = HANDOFF_PATH) -> None:
+    """
+    Delete the intermediate results of a dag's runs last written more than `max_age_days` ago.
+
+    :param dag_id: Dag id.
+    :param max_age_days: Retention of the handoff files in days.
+    :param base_path: Local directory or s3:// prefix for the handoff files.
+    """
+    dag_prefix = f"{base_path.rstrip('/')}/{dag_id}"
+    if dag_prefix.startswith("s3://"):
+        cutoff = dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=max_age_days)
+        wr.s3.delete_objects(f"{dag_prefix}/", last_modified_end=cutoff)
+        return
+
+    if not os.path.isdir(dag_prefix):
+        return
+    cutoff = time.time() - max_age_days * 86400
+    for entry in os.scandir(dag_prefix):
+        if entry.is_dir() and entry.stat().st_mtime < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            print(f"pruned handoff files under {entry.path}")
@@ -0,0 +1,62 @@
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+import pandas as pd
+
+
+def hash_row(row: pd.Series) -> str:
+    """
+    Generate an MD5 hash for a row.
+
+    :param row: A pandas Series representing a row of data.
+    :return: MD5 hash of the concatenated values in the row.
+    """
+    return hashlib.md5(
+        (str(row["requestTimestamp"]) +
+         str(row["agentPhoneNumber"]) +
+         str(row["externalId"])
+         ).encode("utf-8")).hexdigest()
+
+
+def md5_hexdigests(keys: list[str]) -> list[str]:
+    """
+    Generate MD5 hashes for a batch of keys.
+
+    :param keys: Strings to hash.
+    :return: MD5 hex digest of each key, in order.
+    """
+    md5 = hashlib.md5
+    return [md5(key.encode("utf-8")).hexdigest() for key in keys]
+
+
+def hash_rows(df: pd.DataFrame, processes: int = None, chunksize: int = 250_000) -> pd.Series:
+    """
+    Generate the `hash_row` MD5 hash for every row of a DataFrame.
+
+    The `requestTimestamp + agentPhoneNumber + externalId` keys are built column-wise and hashed
+    in bulk, optionally split across a process pool. The digests are identical to
+    `df.apply(hash_row, axis=1)` on the files read with pandas' default inference, where missing
+    values are NaN, also when `df` was read with the declared schema.
+
+    :param df: DataFrame with the `requestTimestamp`, `agentPhoneNumber` and `externalId` columns.
+    :param processes: Number of worker processes, None or 1 hashes in the current process.
+    :param chunksize: Number of keys hashed per worker task.
+    :return: Series of MD5 hex digests aligned with `df`.
+    """
+    def as_str(column: pd.Series) -> pd.Series:
+        # missing values hash as "nan", str() of the NaN the files used to be read with; under the
+        # declared string dtypes they are pd.NA, whose "<NA>" would change the rowIds of loaded rows
+        if column.hasnans:
+            return column.astype(object).where(column.notna(), float("nan")).map(str)
+        return column.astype(str)
+
+    keys = (as_str(df["requestTimestamp"]) + as_str(df["agentPhoneNumber"]) + as_str(df["externalId"])).tolist()
+
+    if processes and processes > 1 and len(keys) > chunksize:
+        chunks = [keys[i:i + chunksize] for i in range(0, len(keys), chunksize)]
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            digests = list(chain.from_iterable(pool.map(md5_hexdigests, chunks)))
+    else:
+        digests = md5_hexdigests(keys)
+
+    return pd.Series(digests, index=df.index, dtype=object)
@@ -0,0 +1,136 @@
+import time
+import resource
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from airflow.exceptions import AirflowException
+from airflow.operators.python import get_current_context
+from airflow.stats import Stats
+
+# prefix of every metric sent to the Airflow metrics backend (StatsD / OpenTelemetry)
+METRIC_PREFIX = "daily_transactions"
+
+_current = contextvars.ContextVar("stage_metrics", default=None)
+
+
+class StageMetrics:
+    """
+    Counters and timings of one pipeline stage.
+
+    Helpers add to the metrics of the stage they run in through `current_metrics`, so a task
+    collects its reads, transforms and database writes in one summary.
+    """
+
+    COUNTERS = ("rows_in", "rows_out", "bytes_read", "rows_inserted", "rows_skipped")
+
+    def __init__(self, name: str):
+        """
+        :param name: Stage name, used in the metric names.
+        """
+        self.name = name
+        self.counts = dict.fromkeys(self.COUNTERS, 0)
+        self.lock = threading.Lock()
+        self.duration = None
+        self.peak_rss_mb = None
+
+    def add(self, **counts) -> None:
+        """
+        Add to the stage's counters, writers on several threads can share the same stage.
+
+        :param counts: Amounts keyed by counter name, see `COUNTERS`.
+        """
+        with self.lock:
+            for counter, amount in counts.items():
+                self.counts[counter] += int(amount)
+
+    def summary(self) -> dict:
+        """
+        :return: Dictionary with the stage's counters, duration in seconds and peak RSS in MiB.
+        """
+        return {"stage": self.name, **self.counts, "duration": self.duration, "peak_rss_mb": self.peak_rss_mb}
+
+    def emit(self) -> None:
+        """
+        Send the stage's counters, duration and peak RSS to the Airflow metrics backend.
+        """
+        prefix = f"{METRIC_PREFIX}.{self.name}"
+        for counter, amount in self.counts.items():
+            if amount:
+                Stats.incr(f"{prefix}.{counter}", amount)
+        Stats.timing(f"{prefix}.duration_ms", self.duration * 1000)
+        Stats.gauge(f"{prefix}.peak_rss_mb", self.peak_rss_mb)
+
+
+def peak_rss_mb() -> float:
+    """
+    :return: Peak resident set size of the current process in MiB.
+    """
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_metrics() -> StageMetrics:
+    """
+    :return: Metrics of the stage being measured, or a detached instance outside of `measure`.
+    """
+    return _current.get() or StageMetrics("untracked")
+
+
+@contextmanager
+def measure(name: str):
+    """
+    Measure a stage and send its metrics when the block exits, also if it raises.
+
+    :param name: Stage name.
+    :return: The stage's StageMetrics, also available to helpers through `current_metrics`.
+    """
+    metrics = StageMetrics(name)
+    token = _current.set(metrics)
+    start = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics.duration = time.perf_counter() - start
+        metrics.peak_rss_mb = peak_rss_mb()
+        _current.reset(token)
+        metrics.emit()
+        print(f"stage metrics: {metrics.summary()}")
+
+
+def instrumented(name: str):
+    """
+    Decorator measuring a task callable as one stage and pushing its summary to the `stage_metrics` XCom.
+
+    Use it under `@task`, so the summary is pushed from the task's own context.
+
+    :param name: Stage name.
+    :return: Decorator.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics = None
+            try:
+                with measure(name) as metrics:
+                    return func(*args, **kwargs)
+            finally:
+                if metrics is not None:
+                    push_summary(metrics)
+
+        return wrapper
+
+    return decorator
+
+
+def push_summary(metrics: StageMetrics) -> None:
+    """
+    Push a stage summary to the `stage_metrics` XCom of the running task, if there is one.
+
+    :param metrics: Metrics of the stage.
+    """
+    try:
+        ti = get_current_context()["ti"]
+    except AirflowException:
+        return
+    ti.xcom_push("stage_metrics", metrics.summary())
@@ -0,0 +1,170 @@
+import os
+import sys
+import cProfile
+import functools
+import threading
+import tracemalloc
+from collections import Counter
+from airflow.configuration import conf
+from airflow.exceptions import AirflowException
+from airflow.operators.python import get_current_context
+
+# profile every task when true, a run can also enable it with the `profile` DAG param
+PROFILE_TASKS = os.environ.get("PROFILE_TASKS", "false").lower() == "true"
+# directory the profiles are written to instead of the log folder, e.g. when logs are shipped remotely
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+# seconds between two stack samples, and number of allocation sites in the allocation report
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.005))
+PROFILE_TOP_N = int(os.environ.get("PROFILE_TOP_N", 25))
+
+_active = threading.local()
+
+
+class Profiler:
+    """
+    Profile a block with cProfile, a stack sampler and tracemalloc.
+
+    The outputs are written by `write`:
+
+    - `<name>.prof`: cProfile statistics, for pstats, snakeviz or gprof2dot.
+    - `<name>.folded`: sampled stacks in the collapsed format of flamegraph.pl and speedscope.
+    - `<name>.alloc.txt`: peak traced memory and the top allocation sites still alive at the end.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL, top_n: int = PROFILE_TOP_N):
+        """
+        :param interval: Seconds between two stack samples.
+        :param top_n: Number of allocation sites in the allocation report.
+        """
+        self.interval = interval
+        self.top_n = top_n
+        self.profile = cProfile.Profile()
+        self.samples = Counter()
+        self.snapshot = None
+        self.peak = 0
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started_tracing = False
+
+    @staticmethod
+    def active() -> bool:
+        """
+        :return: Whether a Profiler is running in the current thread.
+        """
+        return getattr(_active, "profiler", None) is not None
+
+    def __enter__(self):
+        _active.profiler = self
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        tracemalloc.reset_peak()
+
+        self._sampler = threading.Thread(target=self._sample, args=(threading.get_ident(),), daemon=True)
+        self._sampler.start()
+        self.profile.enable()
+
+        return self
+
+    def __exit__(self, *exc):
+        self.profile.disable()
+        self._stop.set()
+        self._sampler.join()
+
+        self.snapshot = tracemalloc.take_snapshot()
+        self.peak = tracemalloc.get_traced_memory()[1]
+        if self._started_tracing:
+            tracemalloc.stop()
+        _active.profiler = None
+
+    def _sample(self, thread_id: int) -> None:
+        """
+        Record the stack of the profiled thread every `interval` seconds.
+
+        :param thread_id: Identifier of the profiled thread.
+        """
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def write(self, directory: str, name: str) -> list[str]:
+        """
+        Write the profile outputs.
+
+        :param directory: Directory to write to, created if it does not exist.
+        :param name: Base name of the output files.
+        :return: Paths of the written files.
+        """
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, name)
+
+        self.profile.dump_stats(f"{base}.prof")
+
+        with open(f"{base}.folded", "w") as file:
+            file.writelines(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+        # leave out the profiler's own allocations
+        snapshot = self.snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                                tracemalloc.Filter(False, __file__)])
+        with open(f"{base}.alloc.txt", "w") as file:
+            file.write(f"peak traced memory: {self.peak / 2 ** 20:.1f} MiB\n")
+            file.write(f"top {self.top_n} allocation sites alive at the end:\n")
+            file.writelines(f"{stat}\n" for stat in snapshot.statistics("lineno")[:self.top_n])
+
+        paths = [f"{base}.prof", f"{base}.folded", f"{base}.alloc.txt"]
+        print(f"profile written to {', '.join(paths)}")
+
+        return paths
+
+
+def task_log_dir(ti, base: str = None) -> str:
+    """
+    Directory holding the logs of a task instance, following Airflow's default log filename template.
+
+    :param ti: Running task instance.
+    :param base: Base folder, defaults to Airflow's `base_log_folder`.
+    :return: Path of the directory.
+    """
+    parts = [base or conf.get("logging", "base_log_folder"), f"dag_id={ti.dag_id}", f"run_id={ti.run_id}",
+             f"task_id={ti.task_id}"]
+    if ti.map_index >= 0:
+        parts.append(f"map_index={ti.map_index}")
+
+    return os.path.join(*parts)
+
+
+def profiled(func):
+    """
+    Decorator profiling a task callable when PROFILE_TASKS is true or the run's `profile` param is set.
+
+    The outputs go to a `profile` directory next to the task's logs, or the same layout under PROFILE_DIR,
+    named after the try number like the log files. Without profiling enabled the call goes straight through.
+    Use it under `@task`, so the task context is available.
+
+    :param func: Task callable to profile.
+    :return: Wrapped function.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            context = get_current_context()
+        except AirflowException:
+            context = None
+        if context is None or Profiler.active() or not (PROFILE_TASKS or context["params"].get("profile")):
+            return func(*args, **kwargs)
+
+        ti = context["ti"]
+        profiler = Profiler()
+        try:
+            with profiler:
+                return func(*args, **kwargs)
+        finally:
+            profiler.write(os.path.join(task_log_dir(ti, PROFILE_DIR), "profile"), f"attempt={ti.try_number}")
+
+    return wrapper
@@ -0,0 +1,108 @@
+import os
+import time
+import boto3
+
+# local directory (or shared mount) where downloaded S3 objects are kept, keyed by ETag
+S3_CACHE_PATH = os.environ.get("S3_CACHE_PATH", "/tmp/s3_cache")
+# the least recently used files are evicted once the cache is larger than this, or older than the max age
+S3_CACHE_MAX_GB = float(os.environ.get("S3_CACHE_MAX_GB", 20))
+S3_CACHE_MAX_AGE_DAYS = float(os.environ.get("S3_CACHE_MAX_AGE_DAYS", 3))
+
+
+def split_s3_path(s3_path: str) -> tuple[str, str]:
+    """
+    Split a "bucket/key" path into its bucket and key.
+
+    :param s3_path: S3 path without the s3:// scheme.
+    :return: Bucket name and object key.
+    """
+    bucket, key = s3_path.removeprefix("s3://").split("/", 1)
+
+    return bucket, key
+
+
+def head_object(bucket: str, key: str) -> dict:
+    """
+    Fetch an object's metadata without downloading it.
+
+    :param bucket: S3 bucket name.
+    :param key: Object key.
+    :return: HEAD response, raises botocore's ClientError if the object does not exist.
+    """
+    return boto3.client("s3").head_object(Bucket=bucket, Key=key)
+
+
+def fetch_cached(bucket: str, key: str, cache_dir: str = S3_CACHE_PATH) -> str:
+    """
+    Download an S3 object into the local cache, unless the same content is already there.
+
+    Cached files are named after the object's ETag, so a file that changed in S3 is downloaded
+    again while repeated reads of the same content cost only a HEAD request.
+
+    :param bucket: S3 bucket name.
+    :param key: Object key.
+    :param cache_dir: Directory of the cache.
+    :return: Local path of the object's content.
+    """
+    etag = head_object(bucket, key)["ETag"].strip('"')
+    extension = os.path.splitext(key)[1]
+    path = os.path.join(cache_dir, f"{etag}{extension}")
+
+    if os.path.exists(path):
+        # mark it as recently used for the eviction
+        os.utime(path)
+        print(f"using cached s3://{bucket}/{key} from {path}")
+        return path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    partial_path = f"{path}.{os.getpid()}.part"
+    boto3.client("s3").download_file(bucket, key, partial_path)
+    os.replace(partial_path, path)
+    print(f"downloaded s3://{bucket}/{key} to {path}")
+    evict(cache_dir, keep=path)
+
+    return path
+
+
+def evict(cache_dir: str = S3_CACHE_PATH, max_bytes: float = S3_CACHE_MAX_GB * 2 ** 30,
+          max_age: float = S3_CACHE_MAX_AGE_DAYS * 86400, keep: str = None) -> list[str]:
+    """
+    Delete cached files, least recently used first, until the cache fits in `max_bytes`.
+
+    Files not used for `max_age` seconds are deleted regardless of the size, including partial
+    downloads left behind by killed tasks.
+
+    :param cache_dir: Directory of the cache.
+    :param max_bytes: Maximum total size of the cache.
+    :param max_age: Maximum number of seconds since a file was last used.
+    :param keep: Path that is never evicted, the file the caller is about to read.
+    :return: Paths of the deleted files.
+    """
+    oldest = time.time() - max_age
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if not entry.is_file() or entry.path == keep:
+            continue
+        stat = entry.stat()
+        # another task may still be downloading to a recent partial file
+        if entry.name.endswith(".part") and stat.st_mtime >= oldest:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    entries.sort()
+
+    total = sum(size for _, size, _ in entries) + (os.path.getsize(keep) if keep else 0)
+    evicted = []
+    for mtime, size, path in entries:
+        if total <= max_bytes and mtime >= oldest:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # evicted by a task running at the same time
+            pass
+        total -= size
+        evicted.append(path)
+    if evicted:
+        print(f"evicted {len(evicted)} files from the s3 cache")
+
+    return evicted
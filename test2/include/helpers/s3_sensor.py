@@ -0,0 +1,135 @@
+import time
+import asyncio
+import boto3
+from botocore.exceptions import ClientError
+from airflow.exceptions import AirflowFailException
+from airflow.models import BaseOperator
+from airflow.stats import Stats
+from airflow.triggers.base import BaseTrigger, TriggerEvent
+
+
+def file_exists(client, bucket: str, key: str) -> bool:
+    """
+    Check an object's existence with a HEAD request.
+
+    :param client: boto3 S3 client.
+    :param bucket: S3 bucket name.
+    :param key: Object key.
+    :return: Whether the object exists. Errors other than "not found" are raised.
+    """
+    try:
+        client.head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+
+    return True
+
+
+class S3FileTrigger(BaseTrigger):
+    """
+    Poll S3 with HEAD requests from the triggerer until a file exists or a deadline passes.
+    """
+
+    def __init__(self, bucket: str, key: str, started_at: float, deadline: float, poke_interval: float = 300):
+        """
+        :param bucket: S3 bucket name.
+        :param key: Object key.
+        :param started_at: Epoch seconds at which the wait started.
+        :param deadline: Epoch seconds after which the wait times out.
+        :param poke_interval: Seconds between two HEAD requests.
+        """
+        super().__init__()
+        self.bucket = bucket
+        self.key = key
+        self.started_at = started_at
+        self.deadline = deadline
+        self.poke_interval = poke_interval
+
+    def serialize(self):
+        return (
+            "include.helpers.s3_sensor.S3FileTrigger",
+            {
+                "bucket": self.bucket,
+                "key": self.key,
+                "started_at": self.started_at,
+                "deadline": self.deadline,
+                "poke_interval": self.poke_interval,
+            },
+        )
+
+    async def run(self):
+        client = boto3.client("s3")
+        while True:
+            try:
+                # boto3 is blocking, run the request off the triggerer's event loop
+                exists = await asyncio.to_thread(file_exists, client, self.bucket, self.key)
+            except ClientError as e:
+                yield TriggerEvent({"status": "error", "message": str(e)})
+                return
+
+            if exists:
+                yield TriggerEvent({"status": "success", "waited": time.time() - self.started_at})
+                return
+            if time.time() >= self.deadline:
+                yield TriggerEvent({
+                    "status": "timeout",
+                    "message": f"s3://{self.bucket}/{self.key} did not arrive within "
+                               f"{self.deadline - self.started_at:.0f} seconds",
+                })
+                return
+
+            await asyncio.sleep(min(self.poke_interval, max(self.deadline - time.time(), 0)))
+
+
+class S3FileSensor(BaseOperator):
+    """
+    Wait for an S3 file without holding a worker slot, by deferring the polling to the triggerer.
+
+    The time the file took to arrive is pushed to XCom as `file_arrival_seconds`. When the file
+    does not arrive within `timeout`, or a HEAD request fails for another reason than a missing
+    file, the error is pushed as `check_file_error` and the task fails without retrying.
+    """
+
+    template_fields = ("key",)
+
+    def __init__(self, bucket: str, key: str, timeout: float, poke_interval: float = 300, **kwargs):
+        """
+        :param bucket: S3 bucket name.
+        :param key: Object key, templated.
+        :param timeout: Seconds to wait for the file.
+        :param poke_interval: Seconds between two HEAD requests.
+        """
+        super().__init__(**kwargs)
+        self.bucket = bucket
+        self.key = key
+        self.timeout = timeout
+        self.poke_interval = poke_interval
+
+    def execute(self, context):
+        started_at = time.time()
+        # backfilled days usually find their file at once, skip the trip through the triggerer
+        try:
+            exists = file_exists(boto3.client("s3"), self.bucket, self.key)
+        except ClientError as e:
+            # denied or throttled, fail like an error reported by the trigger so the alert has its message
+            return self.execute_complete(context, {"status": "error", "message": str(e)})
+        if exists:
+            return self.execute_complete(context, {"status": "success", "waited": 0.0})
+
+        self.defer(
+            trigger=S3FileTrigger(self.bucket, self.key, started_at, started_at + self.timeout, self.poke_interval),
+            method_name="execute_complete",
+        )
+
+    def execute_complete(self, context, event: dict):
+        ti = context["ti"]
+        if event["status"] == "success":
+            self.log.info("s3://%s/%s arrived after %.0f seconds", self.bucket, self.key, event["waited"])
+            Stats.timing("daily_transactions.file_arrival_ms", event["waited"] * 1000)
+            ti.xcom_push("file_arrival_seconds", event["waited"])
+            return
+
+        ti.xcom_push("check_file_error", event["message"])
+        raise AirflowFailException(event["message"])
@@ -0,0 +1,86 @@
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = "string[pyarrow]"
+except ImportError:
+    STRING_DTYPE = "string"
+
+AMOUNT_COLUMNS = ["balance", "commission", "amount"]
+
+# declared ingestion schema of the transactions CSV, amounts are read as text and converted to cents
+TRANSACTION_DTYPES = {
+    "date": STRING_DTYPE,
+    "externalId": STRING_DTYPE,
+    "agentPhoneNumber": STRING_DTYPE,
+    "receiverPhoneNumber": STRING_DTYPE,
+    "transactionType": "category",
+    "balance": STRING_DTYPE,
+    "commission": STRING_DTYPE,
+    "amount": STRING_DTYPE,
+}
+
+
+def to_cents(values: pd.Series) -> pd.Series:
+    """
+    Convert decimal amounts written as text to integer cents, without going through floats.
+
+    Digits past the second decimal are rounded half away from zero, like PostgreSQL does when
+    storing into a `numeric(20,2)` column.
+
+    :param values: Series of amounts such as "4000.0", "110" or "-1.5".
+    :return: Series of nullable int64 cents.
+    """
+    text = values.astype(STRING_DTYPE).str.strip()
+    negative = text.str.startswith("-")
+    parts = text.str.lstrip("+-").str.partition(".")
+    whole = parts[0].replace("", "0")
+    fraction = parts[2].fillna("").str.ljust(3, "0")
+
+    cents = (whole.astype("Int64") * 100
+             + fraction.str[:2].astype("Int64")
+             + (fraction.str[2:3] >= "5").astype("Int64"))
+
+    return cents.where(~negative, -cents)
+
+
+def format_cents(cents: pd.Series) -> pd.Series:
+    """
+    Format integer cents as exact decimal strings, e.g. 400000 -> "4000.00".
+
+    :param cents: Series of int64 cents.
+    :return: Series of strings, missing amounts stay missing.
+    """
+    magnitude = cents.abs()
+    text = (magnitude // 100).astype(STRING_DTYPE) + "." + (magnitude % 100).astype(STRING_DTYPE).str.zfill(2)
+
+    return text.where(cents >= 0, "-" + text)
+
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert the amount columns of a frame read with `TRANSACTION_DTYPES` to integer cents.
+
+    :param df: Transaction data read with `TRANSACTION_DTYPES`.
+    :return: The same frame, with the amounts in cents.
+    """
+    for column in AMOUNT_COLUMNS:
+        df[column] = to_cents(df[column])
+
+    return df
+
+
+def read_transactions(path, **kwargs) -> pd.DataFrame:
+    """
+    Read a transactions CSV with the declared schema.
+
+    :param path: Path or buffer of the CSV file.
+    :param kwargs: Extra arguments for `pd.read_csv`.
+    :return: Transaction data with compact dtypes and amounts in cents, an iterator of such
+        chunks when `chunksize` is given.
+    """
+    reader = pd.read_csv(path, dtype=TRANSACTION_DTYPES, **kwargs)
+    if kwargs.get("chunksize"):
+        return map(apply_schema, reader)
+
+    return apply_schema(reader)
@@ -0,0 +1,120 @@
+import os
+import time
+import sqlite3
+
+# SQLite file holding the phoneNumber -> uuid snapshot, the cache is disabled when unset
+USER_CACHE_PATH = os.environ.get("USER_CACHE_PATH")
+# maximum number of mappings kept, the least recently used ones are evicted first
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 1_000_000))
+
+# SQLite limits the number of bound parameters per statement
+BATCH_SIZE = 500
+
+
+class UserCache:
+    """
+    Size-bounded, on-disk cache of user phoneNumber -> uuid mappings with LRU eviction.
+
+    A user's uuid never changes once the phone number is in the user table, so cached entries
+    never need to be invalidated, only evicted to keep the file within `max_size` entries.
+    """
+
+    def __init__(self, path: str, max_size: int = USER_CACHE_SIZE):
+        """
+        :param path: Path of the SQLite file, created if it does not exist.
+        :param max_size: Maximum number of mappings kept.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS user_uuid "
+            "(phone_number TEXT PRIMARY KEY, uuid TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS user_uuid_last_used ON user_uuid (last_used)")
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT count(*) FROM user_uuid").fetchone()[0]
+
+    def get_many(self, phone_numbers: list[str]) -> dict:
+        """
+        Look up cached uuids and mark them as recently used.
+
+        :param phone_numbers: Phone numbers to look up.
+        :return: Dictionary of phone number to uuid for the cache hits.
+        """
+        found = {}
+        phone_numbers = list(phone_numbers)
+        for i in range(0, len(phone_numbers), BATCH_SIZE):
+            batch = phone_numbers[i:i + BATCH_SIZE]
+            placeholders = ", ".join("?" * len(batch))
+            found.update(self.conn.execute(
+                f"SELECT phone_number, uuid FROM user_uuid WHERE phone_number IN ({placeholders})", batch
+            ))
+
+        now = time.time()
+        self.conn.executemany("UPDATE user_uuid SET last_used = ? WHERE phone_number = ?",
+                              ((now, phone_number) for phone_number in found))
+        self.conn.commit()
+        self.hits += len(found)
+        self.misses += len(phone_numbers) - len(found)
+
+        return found
+
+    def put_many(self, mapping: dict) -> None:
+        """
+        Add phone number -> uuid mappings, evicting the least recently used ones over `max_size`.
+
+        :param mapping: Dictionary of phone number to uuid.
+        """
+        now = time.time()
+        self.conn.executemany("INSERT OR REPLACE INTO user_uuid (phone_number, uuid, last_used) VALUES (?, ?, ?)",
+                              ((phone_number, str(uuid), now) for phone_number, uuid in mapping.items()))
+        overflow = len(self) - self.max_size
+        if overflow > 0:
+            self.conn.execute(
+                "DELETE FROM user_uuid WHERE phone_number IN "
+                "(SELECT phone_number FROM user_uuid ORDER BY last_used LIMIT ?)", (overflow,)
+            )
+        self.conn.commit()
+
+    def stats(self) -> dict:
+        """
+        :return: Hit and miss counters of this instance and the current number of entries.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self),
+            "max_size": self.max_size,
+        }
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def get_user_cache():
+    """
+    Open the user cache configured with the USER_CACHE_PATH environment variable.
+
+    :return: UserCache, or None when the cache is not configured.
+    """
+    if not USER_CACHE_PATH:
+        return None
+
+    return UserCache(USER_CACHE_PATH)
@@ -1,26 +1,220 @@
+import os
+import io
+import time
+import atexit
+import datetime
+import threading
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+from airflow.stats import Stats
+from include.helpers.metrics import current_metrics
 
+# maximum number of connections each worker process keeps open per database
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
 
-def establish_connection(host, port, db, user, password):
+_pools = {}
+# the pools raise PoolError when every connection is borrowed, callers wait on a slot instead
+_pool_slots = {}
+_pools_in_use = {}
+_pools_lock = threading.Lock()
+
+
+def pool_key(database_obj: dict) -> tuple:
     """
-    Establish a connection to a PostgreSQL database.
+    :param database_obj: Dictionary containing database connection details (host, user, port, db, password).
+    :return: Hashable key of the database's pool.
+    """
+    return tuple(sorted(database_obj.items()))
+
 
-    :param host: PostgreSQL host address
-    :param port:  PostgreSQL port number. Default is 5432.
-    :param db:  PostgreSQL database name.
-    :param user:  PostgreSQL database user.
-    :param password: PostgreSQL database password.
-    :return: Cursor for executing SQL queries.
+def get_pool(database_obj: dict) -> ThreadedConnectionPool:
     """
+    Get the connection pool of this process for a database, creating it on first use.
+
+    :param database_obj: Dictionary containing database connection details (host, user, port, db, password).
+    :return: Thread-safe psycopg2 connection pool holding at most `POOL_SIZE` connections.
+    """
+    key = pool_key(database_obj)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ThreadedConnectionPool(
+                1, POOL_SIZE,
+                host=database_obj["host"], database=database_obj["db"], user=database_obj["user"],
+                password=database_obj["password"], port=database_obj["port"]
+            )
+            _pool_slots[key] = threading.BoundedSemaphore(POOL_SIZE)
+            _pools_in_use[key] = 0
+            print(f"created connection pool for {database_obj['db']} database")
+
+        return _pools[key]
+
+
+def close_pools() -> None:
+    """
+    Close every connection held by the pools of this process.
+    """
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
+        _pool_slots.clear()
+        _pools_in_use.clear()
+
+
+atexit.register(close_pools)
 
-    # connection for pandas
-    # engine = create_engine(f"postgresql://{user}:{password}@{host}:{port}/{db}")
-    # engine.connect()
-    conn = psycopg2.connect(host=host, database=db, user=user, password=password, port=port)
-    conn.set_session(autocommit=True)
-    cur = conn.cursor()
-    print(f"connected to {db} database")
 
-    return cur
+@contextmanager
+def get_connection(database_obj: dict, autocommit: bool = True):
+    """
+    Borrow a pooled connection to a PostgreSQL database and return it to the pool afterwards.
+
+    When all `POOL_SIZE` connections are borrowed the call blocks until one is returned. The
+    connection is pinged before use and replaced if the server closed it. Without autocommit
+    the block runs in one transaction, committed on success and rolled back on error.
+    Acquisition latency and pool usage are sent to the Airflow metrics backend.
+
+    :param database_obj: Dictionary containing database connection details (host, user, port, db, password).
+    :param autocommit: Whether each statement commits on its own.
+    :return: psycopg2 connection.
+    """
+    pool = get_pool(database_obj)
+    key = pool_key(database_obj)
+    slots = _pool_slots[key]
+
+    start = time.perf_counter()
+    slots.acquire()
+    try:
+        conn = pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+        except psycopg2.Error:
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+    except Exception:
+        slots.release()
+        raise
+    with _pools_lock:
+        _pools_in_use[key] += 1
+        in_use = _pools_in_use[key]
+    Stats.timing("daily_transactions.db.acquire_ms", (time.perf_counter() - start) * 1000)
+    Stats.gauge("daily_transactions.db.pool_in_use", in_use)
+    Stats.gauge("daily_transactions.db.pool_saturation", in_use / POOL_SIZE)
+
+    conn.autocommit = autocommit
+    try:
+        yield conn
+        if not autocommit:
+            conn.commit()
+    except Exception:
+        if not autocommit:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn, close=conn.closed != 0)
+        with _pools_lock:
+            if key in _pools_in_use:
+                _pools_in_use[key] -= 1
+        slots.release()
+
+
+@contextmanager
+def get_cursor(database_obj: dict, autocommit: bool = True):
+    """
+    Borrow a pooled connection (see `get_connection`) and open a cursor on it.
+
+    :param database_obj: Dictionary containing database connection details (host, user, port, db, password).
+    :param autocommit: Whether each statement commits on its own.
+    :return: Cursor for executing SQL queries, closed when the block exits.
+    """
+    with get_connection(database_obj, autocommit) as conn:
+        with conn.cursor() as cur:
+            yield cur
+
+
+def frame_to_csv(df: pd.DataFrame, columns: list[str]) -> io.StringIO:
+    """
+    Serialize a DataFrame into an in-memory CSV buffer that can be streamed with `COPY ... FROM STDIN`.
+
+    The columns are written directly by pandas' CSV writer, so the rows never exist as Python
+    objects. Integers (epoch timestamps, counts) are written without a decimal point and missing
+    values are written as NULL.
+
+    :param df: DataFrame holding the rows.
+    :param columns: Columns to write, in the column order expected by the COPY statement.
+    :return: CSV buffer positioned at the start.
+    """
+    buffer = io.StringIO()
+    df.to_csv(buffer, columns=columns, header=False, index=False, lineterminator="\n")
+    buffer.seek(0)
+
+    return buffer
+
+
+def frame_records(df: pd.DataFrame):
+    """
+    Iterate over the rows of a DataFrame as dictionaries of Python values, for `execute_batch`.
+
+    Rows are produced one at a time, numpy scalars are converted to their Python equivalent and
+    missing values to None, so psycopg2 can adapt every value.
+
+    :param df: DataFrame holding the rows.
+    :return: Iterator of dictionaries keyed by column name.
+    """
+    columns = list(df.columns)
+    for row in df.itertuples(index=False, name=None):
+        yield {column: to_python(value) for column, value in zip(columns, row)}
+
+
+def to_python(value):
+    """
+    Convert a DataFrame cell to a value psycopg2 can adapt.
+
+    :param value: Cell value.
+    :return: The value as a Python scalar, None if it is missing.
+    """
+    if value is None or value is pd.NA or value != value:
+        return None
+
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def copy_to_db(cur, bulk_load: dict, df: pd.DataFrame) -> list[tuple]:
+    """
+    Stream rows into a staging table with `COPY ... FROM STDIN` and merge them into the target table.
+
+    The rows inserted and the rows skipped by `ON CONFLICT` are added to the current stage metrics.
+    A merge returning rows reports insertions with a trailing `inserted` column, otherwise the
+    statement's row count is used.
+
+    :param cur: Cursor for executing SQL queries.
+    :param bulk_load: Dictionary with the `staging`, `copy`, `merge` and `cleanup` SQL statements
+        and the `columns` to write (see include/sql/daily_transaction_sql.py).
+    :param df: DataFrame holding the rows to be inserted.
+    :return: Rows returned by the merge statement's RETURNING clause, if it has one.
+    """
+    start = datetime.datetime.now()
+    cur.execute(bulk_load["staging"])
+    cur.execute(bulk_load["cleanup"])
+    cur.copy_expert(bulk_load["copy"], frame_to_csv(df, bulk_load["columns"]))
+    cur.execute(bulk_load["merge"])
+    if cur.description:
+        returned = cur.fetchall()
+        inserted = sum(row[-1] for row in returned) if cur.description[-1].name == "inserted" else len(returned)
+    else:
+        returned = []
+        inserted = max(cur.rowcount, 0)
+    cur.execute(bulk_load["cleanup"])
+    current_metrics().add(rows_inserted=inserted, rows_skipped=len(df) - inserted)
 
+    elapsed = (datetime.datetime.now() - start).total_seconds()
+    rate = len(df) / elapsed if elapsed else float(len(df))
+    print(f"copy insert complete: {len(df)} rows in {elapsed:.2f}s ({rate:.0f} rows/sec), "
+          f"{inserted} inserted, {len(df) - inserted} skipped")
 
+    return returned
@@ -0,0 +1,153 @@
+"""
+Backfill the user and transaction tables for a range of days, several days at a time.
+
+Runs outside the scheduler, from the project directory of the Airflow image:
+
+    python -m include.scripts.backfill 2023-11-09 2023-12-09 --workers 4
+
+The load is idempotent like the DAG, so days loaded here and later by a catchup run are not
+duplicated; mark the backfilled runs as successful to avoid reading the files again.
+"""
+import os
+import time
+import argparse
+import datetime as dt
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from include.helpers.s3_cache import fetch_cached, split_s3_path
+from include.helpers.schema import TRANSACTION_DTYPES, read_transactions
+from include.helpers.utils import get_cursor
+from include.sql.daily_transaction_sql import (
+    transaction_insert,
+    transaction_bulk_load
+)
+from include.scripts.daily_transaction_callables import prepare_transaction_data, upsert_user_uuids, write_rows
+
+S3_PATH = "mide-product-dump/raw/transactions/transactions-{}.csv"
+
+database_obj = {
+    "host": os.environ.get("DB_HOST"),
+    "user": str(os.environ.get("USER")),
+    "port": str(os.environ.get("PORT")),
+    "db": os.environ.get("DB"),
+    "password": os.environ.get("PASS"),
+}
+
+
+def date_range(start: str, end: str) -> list[str]:
+    """
+    List the days between two dates, both included.
+
+    :param start: First day, as YYYY-MM-DD.
+    :param end: Last day, as YYYY-MM-DD.
+    :return: Days as YYYY-MM-DD strings.
+    """
+    first = dt.date.fromisoformat(start)
+    n_days = (dt.date.fromisoformat(end) - first).days + 1
+
+    return [(first + dt.timedelta(days=i)).isoformat() for i in range(n_days)]
+
+
+def extract_day(run_date: str, s3_path: str) -> dict:
+    """
+    Download a day's file into the local cache and collect its agents.
+
+    :param run_date: The date for which the data is being processed.
+    :param s3_path: S3 path for the data.
+    :return: Dictionary with the local path, row count, sorted unique agents and duration.
+    """
+    start = time.perf_counter()
+    local_path = fetch_cached(*split_s3_path(s3_path.format(run_date)))
+    df = pd.read_csv(local_path, usecols=["agentPhoneNumber"], dtype=TRANSACTION_DTYPES)
+
+    return {
+        "run_date": run_date,
+        "local_path": local_path,
+        "rows": len(df),
+        "agents": sorted(df["agentPhoneNumber"].map(str).unique()),
+        "extract_seconds": time.perf_counter() - start,
+    }
+
+
+def load_day_transactions(run_date: str, local_path: str, df_user: pd.DataFrame = None) -> dict:
+    """
+    Transform a day's transactions and write them to the transaction table.
+
+    :param run_date: The date for which the data is being processed.
+    :param local_path: Cached copy of the day's file.
+    :param df_user: The day's `phoneNumber`/`uuid` mapping from the user upsert.
+    :return: Dictionary with the number of rows written and the duration.
+    """
+    start = time.perf_counter()
+    with get_cursor(database_obj) as cur:
+        df = prepare_transaction_data(read_transactions(local_path), cur, df_user=df_user)
+        write_rows(cur, transaction_insert, df, transaction_bulk_load)
+
+    return {"run_date": run_date, "transactions": len(df), "load_seconds": time.perf_counter() - start}
+
+
+def backfill(start: str, end: str, workers: int = 4, s3_path: str = S3_PATH) -> list[dict]:
+    """
+    Load the files of a date range in three phases.
+
+    1. The files are downloaded and read concurrently, one process per day.
+    2. The agents of every day are upserted into the user table one day after another, in date
+       order, so the outcome does not depend on which process finishes first.
+    3. The transactions of each day are transformed and loaded concurrently, joined with the
+       uuids the day's user upsert returned.
+
+    :param start: First day, as YYYY-MM-DD.
+    :param end: Last day, as YYYY-MM-DD.
+    :param workers: Number of days processed at the same time.
+    :param s3_path: S3 path for the data.
+    :return: Per-day statistics, in date order.
+    """
+    days = date_range(start, end)
+    wall_start = time.perf_counter()
+
+    # spawn, so the workers never share the parent's pooled connections
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        extracted = list(pool.map(extract_day, days, [s3_path] * len(days)))
+
+        with get_cursor(database_obj) as cur:
+            for day in extracted:
+                start_users = time.perf_counter()
+                day["users"] = upsert_user_uuids(cur, pd.DataFrame({"agentPhoneNumber": day["agents"]}))
+                day["user_seconds"] = time.perf_counter() - start_users
+
+        loaded = list(pool.map(load_day_transactions, days, [day["local_path"] for day in extracted],
+                               [day.pop("users") for day in extracted]))
+
+    stats = []
+    for day, load_stats in zip(extracted, loaded):
+        seconds = day["extract_seconds"] + day["user_seconds"] + load_stats["load_seconds"]
+        stats.append({
+            "run_date": day["run_date"],
+            "rows": day["rows"],
+            "users": len(day["agents"]),
+            "transactions": load_stats["transactions"],
+            "seconds": seconds,
+            "rows_per_second": day["rows"] / seconds if seconds else 0.0,
+        })
+        print(f"{day['run_date']}: {day['rows']} rows, {len(day['agents'])} users, "
+              f"{load_stats['transactions']} transactions in {seconds:.1f}s "
+              f"({stats[-1]['rows_per_second']:.0f} rows/sec)")
+
+    wall_seconds = time.perf_counter() - wall_start
+    total_rows = sum(day["rows"] for day in stats)
+    print(f"backfilled {len(days)} days, {total_rows} rows in {wall_seconds:.1f}s "
+          f"({total_rows / wall_seconds:.0f} rows/sec)")
+
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill the daily transaction files of a date range.")
+    parser.add_argument("start", help="first day, YYYY-MM-DD")
+    parser.add_argument("end", help="last day, YYYY-MM-DD")
+    parser.add_argument("--workers", type=int, default=4, help="days processed at the same time")
+    parser.add_argument("--s3-path", default=S3_PATH, help="bucket/key template of the daily files")
+    args = parser.parse_args()
+
+    backfill(args.start, args.end, args.workers, args.s3_path)
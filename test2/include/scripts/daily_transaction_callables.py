@@ -1,127 +1,732 @@
-import json
-import hashlib
-from sqlalchemy import create_engine
+import io
+import os
+import csv
+import math
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from airflow.decorators import task
+from airflow.exceptions import AirflowSkipException
 from psycopg2.extras import execute_batch
 import psycopg2
 import pandas as pd
-import awswrangler as wr
-import datetime as dt
+from include.helpers.utils import copy_to_db, frame_records, get_connection, get_cursor, POOL_SIZE
+from include.helpers.handoff import spill, load, count_rows, prune, remove_run
+from include.helpers.engines import check_engine, epoch_ms
+from include.helpers.hashing import hash_rows
+from include.helpers.metrics import current_metrics, instrumented
+from include.helpers.profiling import profiled
+from include.helpers.schema import AMOUNT_COLUMNS, format_cents, read_transactions
+from include.helpers.user_cache import get_user_cache
+from include.helpers.s3_cache import fetch_cached, head_object, split_s3_path
+from include.helpers.bloom import ROWID_BLOOM_PATH, RowIdBloomFilter, get_row_id_filter, row_id_filter_lock
+from airflow.operators.python import get_current_context
+from include.sql.daily_transaction_sql import (
+    users_insert,
+    transaction_insert,
+    users_bulk_load,
+    transaction_bulk_load,
+    user_lookup,
+    user_lookup_bulk_load,
+    create_watermark_table,
+    watermark_select,
+    watermark_upsert,
+    existing_row_ids
+)
 
 
-def establish_connection(host, port, db, user, password):
+@task()
+@instrumented("extract")
+@profiled
+def get_transaction_data(run_date: str, s3_path: str, database_obj: dict = None) -> str:
     """
-     Establish a connection to a PostgreSQL database.
+    Read transaction data from an S3 path.
+
+    The object is fetched through the ETag-keyed local cache, so it is downloaded once even when
+    several tasks read the same file. With `database_obj` the read is incremental: only rows that
+    are not in the transaction table yet are handed off, and the file's watermark is pushed to
+    XCom for `record_watermark`.
 
-    :param host: PostgreSQL host address
-    :param port:  PostgreSQL port number. Default is 5432.
-    :param db:  PostgreSQL database name.
-    :param user:  PostgreSQL database user.
-    :param password: PostgreSQL database password.
-    :return: Cursor for executing SQL queries.
+    :param run_date: The date for which the data is being processed.
+    :param s3_path: S3 path for the data.
+    :param database_obj: Database connection details, enables the incremental read.
+    :return: Handoff reference to the transaction data read from the specified S3 path.
     """
+    # prev_file_date = str((dt.datetime.strptime(run_date, "%Y-%m-%d") - dt.timedelta(days=1)).strftime("%Y-%m-%d"))
 
-    conn = psycopg2.connect(host=host, database=db, user=user, password=password, port=port)
-    conn.set_session(autocommit=True)
-    cur = conn.cursor()
-    print(f"connected to {db} database")
+    bucket, key = split_s3_path(s3_path.format(run_date))
+    local_path = fetch_cached(bucket, key)
+    df = read_transactions(local_path)
+    current_metrics().add(rows_in=len(df), bytes_read=os.path.getsize(local_path))
 
-    return cur
+    if database_obj:
+        request_timestamps = epoch_ms(df["date"])
+        get_current_context()["ti"].xcom_push("watermark", file_watermark(key, local_path, request_timestamps))
+        with get_cursor(database_obj) as cur:
+            df = filter_new_rows(df, request_timestamps, cur, get_watermark(cur, key))
+    current_metrics().add(rows_out=len(df))
 
+    return spill(df)
 
-def hash_row(row: pd.Series) -> str:
+
+def prepare_user_data(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Generate an MD5 hash for a row.
+    Remove duplicate agents from transaction data.
 
-    :param row: A pandas Series representing a row of data.
-    :return: MD5 hash of the concatenated values in the row.
+    :param df: Transaction data DataFrame.
+    :return: One row per agent phone number.
     """
-    return hashlib.md5(
-        (str(row["requestTimestamp"]) +
-         str(row["agentPhoneNumber"]) +
-         str(row["externalId"])
-         ).encode("utf-8")).hexdigest()
+    return df.drop_duplicates(subset=["agentPhoneNumber"])
 
 
-@task()
-def get_transaction_data(run_date: str, s3_path: str) -> pd.DataFrame:
+def lookup_user_uuids(cur, phone_numbers: list[str], temp_table_threshold: int = 10_000) -> pd.DataFrame:
     """
-    Read transaction data from an S3 path.
+    Look up the uuids of the given agent phone numbers in the user table.
 
-    :param run_date: The date for which the data is being processed.
-    :param s3_path: S3 path for the data.
-    :return: Transaction data read from the specified S3 path.
+    The keys are sent as a bound array (`= ANY(...)`), or for more than `temp_table_threshold`
+    keys they are copied into a temp table and joined server-side, so the statement text stays
+    the same size however many agents a file has.
+
+    :param cur: Cursor for executing SQL queries.
+    :param phone_numbers: Unique agent phone numbers.
+    :param temp_table_threshold: Number of keys above which the temp table join is used.
+    :return: DataFrame with the `phoneNumber` and `uuid` columns.
     """
-    # prev_file_date = str((dt.datetime.strptime(run_date, "%Y-%m-%d") - dt.timedelta(days=1)).strftime("%Y-%m-%d"))
+    if not phone_numbers:
+        return pd.DataFrame(columns=["phoneNumber", "uuid"])
 
-    s3_file_path = [f"s3://{s3_path.format(run_date)}"]
+    if len(phone_numbers) > temp_table_threshold:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows([phone_number] for phone_number in phone_numbers)
+        buffer.seek(0)
 
-    return wr.s3.read_csv(s3_file_path)
+        cur.execute(user_lookup_bulk_load["staging"])
+        cur.execute(user_lookup_bulk_load["cleanup"])
+        cur.copy_expert(user_lookup_bulk_load["copy"], buffer)
+        cur.execute(user_lookup_bulk_load["lookup"])
+        rows = cur.fetchall()
+        cur.execute(user_lookup_bulk_load["cleanup"])
+    else:
+        cur.execute(user_lookup, {"phone_numbers": list(phone_numbers)})
+        rows = cur.fetchall()
 
+    return pd.DataFrame(rows, columns=["phoneNumber", "uuid"])
 
-@task()
-def transform_user_data(df: pd.DataFrame) -> list[dict]:
+
+def resolve_user_uuids(cur, phone_numbers: list[str], user_cache=None) -> pd.DataFrame:
     """
-     Transform user data by removing duplicates.
+    Resolve agent phone numbers to user uuids, asking the database only about cache misses.
 
-    :param df: User data DataFrame.
-    :return: JSON representation of the transformed user data.
+    :param cur: Cursor for executing SQL queries.
+    :param phone_numbers: Unique agent phone numbers.
+    :param user_cache: Optional UserCache, filled with the mappings read from the database.
+    :return: DataFrame with the `phoneNumber` and `uuid` columns.
     """
-    df.drop_duplicates(subset=["agentPhoneNumber"], inplace=True)
+    if user_cache is None:
+        return lookup_user_uuids(cur, phone_numbers)
 
-    return json.loads(df.to_json(orient="records"))
+    cached = user_cache.get_many(phone_numbers)
+    misses = [phone_number for phone_number in phone_numbers if phone_number not in cached]
+    df_user = lookup_user_uuids(cur, misses) if misses else pd.DataFrame(columns=["phoneNumber", "uuid"])
+    user_cache.put_many(dict(zip(df_user["phoneNumber"], df_user["uuid"])))
+    print(f"user cache: {user_cache.stats()}")
 
+    df_cached = pd.DataFrame(list(cached.items()), columns=["phoneNumber", "uuid"])
 
-@task()
-def transform_transaction_data(df: pd.DataFrame, uri: str) -> list[dict]:
+    return pd.concat([df_cached, df_user], ignore_index=True)
+
+
+def upsert_user_uuids(cur, user_data: pd.DataFrame) -> pd.DataFrame:
     """
-    Transform transaction data by applying necessary changes and joining with user data.
+    Insert the new agents into the user table and resolve the uuids of all of them.
+
+    The bulk load merge returns `phoneNumber, uuid` for every staged agent, new or not, so the
+    mapping comes back with the upsert itself. Agents it misses, because the batch insert fallback
+    was used or another writer committed them concurrently, are looked up afterwards.
+
+    :param cur: Cursor for executing SQL queries.
+    :param user_data: User data with unique `agentPhoneNumber` values.
+    :return: DataFrame with the `phoneNumber` and `uuid` columns.
+    """
+    returned = write_rows(cur, users_insert, user_data, users_bulk_load)
+    df_user = pd.DataFrame([row[:2] for row in returned], columns=["phoneNumber", "uuid"])
+
+    missing = sorted(set(user_data["agentPhoneNumber"].map(str)) - set(df_user["phoneNumber"]))
+    if missing:
+        df_user = pd.concat([df_user, lookup_user_uuids(cur, missing)], ignore_index=True)
+    df_user["uuid"] = df_user["uuid"].map(str)
 
-    :param df:  Transaction data DataFrame.
-    :param uri: URI for connecting to the database.
-    :return:  JSON representation of the transformed transaction data.
+    return df_user
+
+
+def prepare_transaction_data(df: pd.DataFrame, cur, hash_processes: int = None, user_cache=None,
+                             engine: str = "pandas", df_user: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    Apply the transaction changes (timestamps, rowId hash) and join with user data.
+
+    :param df: Transaction data DataFrame.
+    :param cur: Cursor for looking up user uuids.
+    :param hash_processes: Number of processes used to hash the rowIds (see `hash_rows`).
+    :param user_cache: Optional UserCache consulted before the user table.
+    :param engine: Dataframe backend converting the timestamps, one of `engines.ENGINES`.
+    :param df_user: The `phoneNumber`/`uuid` mapping returned by the user upsert, when given the
+        user table is not queried.
+    :return: Transformed transaction data with the `transactions_columns` columns.
     """
-    engine = create_engine(uri)
-    engine.connect()
     transactions_columns = ["agentPhoneNumber", "receiverPhoneNumber", "transactionType", "userUuid", "balance",
                             "commission", "amount",
                             "requestTimestamp", "updateTimestamp", "externalId", "rowId"]
 
-    df["date"] = df["date"].apply(
-        lambda x: int(
-            dt.datetime.strptime(x, "%Y-%m-%d %H:%M:%S").timestamp() * 1000
-        )
-    )
+    df["date"] = epoch_ms(df["date"], engine=engine)
 
-    df["agentPhoneNumber_filter"] = df["agentPhoneNumber"].apply(lambda x: f"'{x}'")
     df["agentPhoneNumber"] = df["agentPhoneNumber"].map(str)
     df["requestTimestamp"] = df["date"]
     df["updateTimestamp"] = df["date"]
-    df["rowId"] = df.apply(hash_row, axis=1)
+    df["rowId"] = hash_rows(df, processes=hash_processes)
 
-    user_condition = ", ".join(list(df["agentPhoneNumber_filter"].unique()))
-    sql = f'select * from public.user_airflow where "phoneNumber" in ({user_condition})'
-    df_user = pd.read_sql(sql=sql, con=engine)
+    if df_user is None:
+        df_user = resolve_user_uuids(cur, df["agentPhoneNumber"].unique().tolist(), user_cache)
     df_join = df.merge(df_user, left_on="agentPhoneNumber", right_on=["phoneNumber"], how="inner")
     df_join["uuid"] = df_join["uuid"].map(str)
     df_join.rename(columns={"uuid": "userUuid"}, inplace=True)
     df_join.drop_duplicates(inplace=True)
+    for column in AMOUNT_COLUMNS:
+        df_join[column] = format_cents(df_join[column])
+
+    return df_join[transactions_columns]
+
+
+def get_watermark(cur, file_key: str) -> dict:
+    """
+    Read the watermark recorded for a file.
+
+    :param cur: Cursor for executing SQL queries.
+    :param file_key: S3 key of the file.
+    :return: Dictionary with the `etag`, `rowCount` and `maxRequestTimestamp`, None if the file was never loaded.
+    """
+    cur.execute(create_watermark_table)
+    cur.execute(watermark_select, {"fileKey": file_key})
+    row = cur.fetchone()
+    if row is None:
+        return None
+
+    return dict(zip(["etag", "rowCount", "maxRequestTimestamp"], row))
+
+
+def file_watermark(file_key: str, local_path: str, request_timestamps: pd.Series) -> dict:
+    """
+    Build the watermark of a file from its cached copy.
+
+    :param file_key: S3 key of the file.
+    :param local_path: Path returned by `fetch_cached`, named after the file's ETag.
+    :param request_timestamps: `requestTimestamp` of every row of the file.
+    :return: Dictionary with the `fileKey`, `etag`, `rowCount` and `maxRequestTimestamp`.
+    """
+    return {
+        "fileKey": file_key,
+        "etag": os.path.splitext(os.path.basename(local_path))[0],
+        "rowCount": int(len(request_timestamps)),
+        "maxRequestTimestamp": int(request_timestamps.max()) if len(request_timestamps) else None,
+    }
+
+
+def filter_new_rows(df: pd.DataFrame, request_timestamps: pd.Series, cur, watermark: dict,
+                    batch_size: int = 50_000) -> pd.DataFrame:
+    """
+    Drop the rows of a previously loaded file that are already in the transaction table.
+
+    Rows newer than the watermark's `maxRequestTimestamp` are new by construction. Older rows are
+    checked by `rowId` against the transaction table, so rows added to an already loaded file
+    are still picked up.
+
+    :param df: Transaction data as read from the file.
+    :param request_timestamps: `requestTimestamp` of every row of `df`.
+    :param cur: Cursor for executing SQL queries.
+    :param watermark: Watermark of the file's previous load, None if it was never loaded.
+    :param batch_size: Number of rowIds checked per query.
+    :return: The rows of `df` that still have to be loaded.
+    """
+    if watermark is None or watermark["maxRequestTimestamp"] is None:
+        return df
+
+    candidates = request_timestamps <= watermark["maxRequestTimestamp"]
+    row_ids = hash_rows(pd.DataFrame({
+        "requestTimestamp": request_timestamps[candidates],
+        "agentPhoneNumber": df.loc[candidates, "agentPhoneNumber"].map(str),
+        "externalId": df.loc[candidates, "externalId"],
+    }))
+
+    is_loaded = pd.Series(False, index=df.index)
+    is_loaded[candidates] = row_ids.isin(loaded_row_ids(cur, row_ids.unique().tolist(), batch_size))
+    print(f"{int(is_loaded.sum())} of {len(df)} rows already loaded")
 
-    return json.loads(df_join[transactions_columns].to_json(orient="records"))
+    return df[~is_loaded]
+
+
+def loaded_row_ids(cur, row_ids: list[str], batch_size: int = 50_000) -> set:
+    """
+    Find which rowIds are already in the transaction table.
+
+    :param cur: Cursor for executing SQL queries.
+    :param row_ids: Unique rowIds to check.
+    :param batch_size: Number of rowIds checked per query.
+    :return: The rowIds that exist in the table.
+    """
+    loaded = set()
+    for i in range(0, len(row_ids), batch_size):
+        cur.execute(existing_row_ids, {"row_ids": row_ids[i:i + batch_size]})
+        loaded.update(row_id for row_id, in cur.fetchall())
+
+    return loaded
+
+
+def drop_loaded_rows(df: pd.DataFrame, cur, row_id_filter) -> pd.DataFrame:
+    """
+    Drop transaction rows that are already loaded, using a Bloom filter of loaded rowIds.
+
+    Rows the filter has never seen are new and kept without a database round trip. Filter hits
+    may be false positives, so they are confirmed against the transaction table before dropping.
+
+    :param df: Transaction data with a `rowId` column.
+    :param cur: Cursor for executing SQL queries.
+    :param row_id_filter: RowIdBloomFilter of the rowIds loaded by earlier runs.
+    :return: The rows of `df` that still have to be loaded.
+    """
+    maybe_loaded = row_id_filter.contains_many(df["rowId"].tolist())
+    hits = df["rowId"][maybe_loaded].unique().tolist()
+    loaded = loaded_row_ids(cur, hits) if hits else set()
+    print(f"rowId filter: {len(hits)} hits, {len(loaded)} confirmed loaded, "
+          f"{len(hits) - len(loaded)} false positives")
+
+    return df[~df["rowId"].isin(loaded)]
+
+
+def remember_row_ids(added: RowIdBloomFilter) -> None:
+    """
+    Merge the rowIds a task loaded into the Bloom filter file configured with ROWID_BLOOM_PATH.
+
+    The file is reloaded under the lock, so additions of tasks that ran meanwhile are kept. Each
+    save rewrites the whole filter, so a run calls this once.
+
+    :param added: Filter created with `RowIdBloomFilter.empty_like`, holding the rowIds written
+        to the transaction table.
+    :return:
+    """
+    with row_id_filter_lock():
+        row_id_filter = get_row_id_filter()
+        row_id_filter.update(added)
+        row_id_filter.save(ROWID_BLOOM_PATH)
+    print(f"rowId filter holds {row_id_filter.count} rowIds "
+          f"(expected false-positive rate {row_id_filter.false_positive_rate():.4%})")
+
+
+def write_rows(cur, query: str, df: pd.DataFrame, bulk_load: dict = None) -> list[tuple]:
+    """
+    Write rows with the provided cursor.
+
+    When `bulk_load` is given the rows are loaded with `COPY` through a staging table, and
+    `query` is only used as a fallback if the bulk load fails.
+
+    :param cur: Cursor for executing SQL queries.
+    :param query: SQL query for inserting data.
+    :param df: DataFrame holding the rows to be inserted.
+    :param bulk_load: COPY/merge statements for the target table (see include/sql/daily_transaction_sql.py).
+    :return: Rows returned by the bulk load merge, empty for the batch insert path.
+    """
+    if bulk_load:
+        # inside a transaction a failed COPY aborts it, roll back to here before the fallback
+        in_transaction = not cur.connection.autocommit
+        if in_transaction:
+            cur.execute("SAVEPOINT bulk_load")
+        try:
+            return copy_to_db(cur, bulk_load, df)
+        except psycopg2.Error as e:
+            print("error bulk loading to table, falling back to batch insert")
+            print(e)
+            if in_transaction:
+                cur.execute("ROLLBACK TO SAVEPOINT bulk_load")
+
+    execute_batch(cur, query, frame_records(df), page_size=1000)
+    print("batch insert complete")
+
+    return []
+
+
+def write_partitioned(database_obj: dict, query: str, df: pd.DataFrame, bulk_load: dict = None,
+                      workers: int = 4, batch_size: int = 50_000) -> None:
+    """
+    Write transaction rows concurrently, split into partitions by a hash of their `rowId`.
+
+    Each partition is loaded over its own pooled connection in a single transaction. Partitions
+    never share a `rowId`, so the concurrent `ON CONFLICT ("rowId") DO NOTHING` inserts cannot
+    block each other, and reruns stay idempotent.
+
+    :param database_obj: Dictionary containing database connection details (host, user, port, db, password).
+    :param query: SQL query for inserting data.
+    :param df: Transaction data with a `rowId` column.
+    :param bulk_load: COPY/merge statements for the target table (see include/sql/daily_transaction_sql.py).
+    :param workers: Number of partitions loaded at the same time, capped at the pool size.
+    :param batch_size: Number of rows written per statement batch within a partition.
+    :return:
+    """
+    if workers > POOL_SIZE:
+        print(f"limiting {workers} writers to the connection pool size of {POOL_SIZE}")
+        workers = POOL_SIZE
+
+    partition_ids = pd.util.hash_pandas_object(df["rowId"], index=False) % workers
+
+    def write_partition(partition: pd.DataFrame) -> int:
+        with get_connection(database_obj, autocommit=False) as conn:
+            with conn.cursor() as cur:
+                for i in range(0, len(partition), batch_size):
+                    batch = partition.iloc[i:i + batch_size]
+                    write_rows(cur, query, batch, bulk_load)
+
+        return len(partition)
+
+    partitions = [partition for _, partition in df.groupby(partition_ids.values)]
+    # each writer runs in a copy of this context, so it adds to the same stage metrics
+    contexts = [contextvars.copy_context() for _ in partitions]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        written = list(pool.map(lambda context, partition: context.run(write_partition, partition),
+                                contexts, partitions))
+    print(f"wrote {sum(written)} rows over {len(partitions)} partitions")
+
+
+def shard_count(n_rows: int, shard_rows: int, max_shards: int) -> int:
+    """
+    Pick the number of shards for a file: about `shard_rows` rows each, at most `max_shards`.
+
+    :param n_rows: Number of rows of the file.
+    :param shard_rows: Target number of rows per shard.
+    :param max_shards: Maximum number of shards.
+    :return: Number of shards, at least one.
+    """
+    return max(1, min(max_shards, math.ceil(n_rows / shard_rows)))
 
 
 @task()
-def write_data_to_db(database_obj: dict, query: str, data: list[dict]):
+@profiled
+def split_transaction_data(data_ref: str, shard_rows: int = 500_000, max_shards: int = 16) -> list[str]:
+    """
+    Split the day's transaction data into shards for mapped transform and load tasks.
+
+    Rows are assigned to shards by a hash of the columns that make up their `rowId`, so duplicate
+    rows always land in the same shard and concurrent shard loads never insert the same `rowId`.
+
+    :param data_ref: Handoff reference to the transaction data.
+    :param shard_rows: Target number of rows per shard, small files stay in one shard.
+    :param max_shards: Maximum number of shards.
+    :return: Handoff references to the shards.
+    """
+    df = load(data_ref)
+    n_shards = shard_count(len(df), shard_rows, max_shards)
+    if n_shards == 1:
+        return [data_ref]
+
+    shard_ids = pd.util.hash_pandas_object(df[["date", "agentPhoneNumber", "externalId"]], index=False) % n_shards
+    print(f"splitting {len(df)} rows into {n_shards} shards")
+
+    return [spill(shard, f"shard-{shard_id}") for shard_id, shard in df.groupby(shard_ids.values)]
+
+
+@task()
+@profiled
+def verify_shards(data_ref: str, shard_refs: list[str], ready_refs: list[str], written: list[int]) -> dict:
+    """
+    Check that the mapped shard tasks covered every row of the day's transaction data.
+
+    Every shard must come from the input, and every rowId that came out of the transforms must be in
+    the transaction table after the loads. The rows the transforms dropped (repeated rows, agents
+    without a uuid, rows loaded by earlier runs) are reported. Once the loads are confirmed, their
+    rowIds are added to the Bloom filter of loaded rowIds, if one is configured.
+
+    :param data_ref: Handoff reference to the transaction data.
+    :param shard_refs: Handoff references to the shards.
+    :param ready_refs: Handoff references to the transformed shards.
+    :param written: Number of distinct rowIds each shard load found in the transaction table.
+    :return: Row counts of each stage.
+    """
+    row_id_filter = get_row_id_filter()
+    added = RowIdBloomFilter.empty_like(row_id_filter) if row_id_filter is not None else None
+    transformed_row_ids = 0
+    for ref in ready_refs:
+        row_ids = load(ref, columns=["rowId"])["rowId"].unique().tolist()
+        # a rowId always lands in a single shard, so the per-shard counts add up
+        transformed_row_ids += len(row_ids)
+        if added is not None:
+            added.add_many(row_ids)
+
+    counts = {
+        "input": count_rows(data_ref),
+        "sharded": sum(count_rows(ref) for ref in shard_refs),
+        "transformed": sum(count_rows(ref) for ref in ready_refs),
+        "transformed_row_ids": transformed_row_ids,
+        "written": sum(written),
+        "shards": len(shard_refs),
+    }
+    counts["dropped"] = counts["sharded"] - counts["transformed"]
+    print(f"shard counts: {counts}")
+    print(f"{counts['dropped']} of {counts['sharded']} rows dropped by the transforms")
+
+    if counts["sharded"] != counts["input"]:
+        raise ValueError(f"shards hold {counts['sharded']} rows, the input has {counts['input']}")
+    if counts["written"] != counts["transformed_row_ids"]:
+        raise ValueError(f"{counts['written']} rowIds found in the transaction table, "
+                         f"{counts['transformed_row_ids']} were transformed")
+
+    if added is not None:
+        remember_row_ids(added)
+
+    return counts
+
+
+@task()
+@instrumented("transform_users")
+@profiled
+def transform_user_data(data_ref: str) -> str:
+    """
+     Transform user data by removing duplicates.
+
+    :param data_ref: Handoff reference to the user data.
+    :return: Handoff reference to the transformed user data.
+    """
+    df_data = load(data_ref)
+    df = prepare_user_data(df_data)
+    current_metrics().add(rows_in=len(df_data), rows_out=len(df))
+
+    return spill(df)
+
+
+@task()
+@instrumented("transform_transactions")
+@profiled
+def transform_transaction_data(data_ref: str, database_obj: dict, hash_processes: int = None,
+                               engine: str = "pandas", user_map_ref: str = None) -> str:
+    """
+    Transform transaction data by applying necessary changes and joining with user data.
+
+    :param data_ref: Handoff reference to the transaction data.
+    :param database_obj: Dictionary containing database connection details (host, user, port, db, password).
+    :param hash_processes: Number of processes used to hash the rowIds.
+    :param engine: Dataframe backend converting the timestamps, one of `engines.ENGINES`.
+    :param user_map_ref: Handoff reference to the mapping returned by `write_user_data`, when
+        given the user table is not queried.
+    :return: Handoff reference to the transformed transaction data.
+    """
+    check_engine(engine)
+    df_user = load(user_map_ref) if user_map_ref else None
+    user_cache = get_user_cache() if df_user is None else None
+    row_id_filter = get_row_id_filter()
+    df = load(data_ref)
+    current_metrics().add(rows_in=len(df))
+    with get_cursor(database_obj) as cur:
+        df_join = prepare_transaction_data(df, cur, hash_processes, user_cache, engine, df_user)
+        if row_id_filter is not None:
+            df_join = drop_loaded_rows(df_join, cur, row_id_filter)
+    current_metrics().add(rows_out=len(df_join))
+    if user_cache is not None:
+        get_current_context()["ti"].xcom_push("user_cache_stats", user_cache.stats())
+        user_cache.close()
+
+    return spill(df_join)
+
+
+@task()
+@instrumented("load")
+@profiled
+def write_data_to_db(database_obj: dict, query: str, data_ref: str, bulk_load: dict = None,
+                     workers: int = 1, batch_size: int = 50_000):
     """
     Write data to a PostgreSQL database.
 
     :param database_obj: Dictionary containing database connection details (host, user, port, db, password).
     :param query: SQL query for inserting data.
-    :param data: List of dictionaries representing the data to be inserted.
+    :param data_ref: Handoff reference to the data to be inserted.
+    :param bulk_load: COPY/merge statements for the target table (see include/sql/daily_transaction_sql.py).
+    :param workers: Number of concurrent writers, more than one partitions the rows by `rowId`
+        (see `write_partitioned`).
+    :param batch_size: Number of rows written per statement batch by each concurrent writer.
+    :return: Number of the data's distinct rowIds found in the table after the load, or the number of
+        rows sent when the data has no rowId.
+    """
+    df = load(data_ref)
+    current_metrics().add(rows_in=len(df))
+    if workers > 1:
+        write_partitioned(database_obj, query, df, bulk_load, workers, batch_size)
+    else:
+        with get_cursor(database_obj) as cur:
+            write_rows(cur, query, df, bulk_load)
+
+    if "rowId" not in df.columns:
+        return len(df)
+
+    # confirm what the table actually holds, whichever writer or fallback path ran
+    row_ids = df["rowId"].unique().tolist()
+    with get_cursor(database_obj) as cur:
+        confirmed = len(loaded_row_ids(cur, row_ids))
+    print(f"{confirmed} of {len(row_ids)} rowIds confirmed in the table")
+
+    return confirmed
+
+
+@task()
+@instrumented("load_users")
+@profiled
+def write_user_data(database_obj: dict, data_ref: str) -> str:
+    """
+    Upsert the day's agents into the user table and hand off their uuids.
+
+    :param database_obj: Dictionary containing database connection details (host, user, port, db, password).
+    :param data_ref: Handoff reference to the transformed user data.
+    :return: Handoff reference to the `phoneNumber`/`uuid` mapping of every agent in the data.
+    """
+    df = load(data_ref, columns=["agentPhoneNumber"])
+    with get_cursor(database_obj) as cur:
+        df_user = upsert_user_uuids(cur, df)
+    current_metrics().add(rows_in=len(df), rows_out=len(df_user))
+
+    user_cache = get_user_cache()
+    if user_cache is not None:
+        with user_cache:
+            user_cache.put_many(dict(zip(df_user["phoneNumber"], df_user["uuid"])))
+
+    return spill(df_user, "users")
+
+
+@task()
+@instrumented("stream")
+@profiled
+def stream_transaction_data(run_date: str, s3_path: str, database_obj: dict, chunksize: int,
+                            incremental: bool = False) -> None:
+    """
+    Read, transform and load the day's transactions in fixed-size chunks.
+
+    Each chunk is written to the user table before its transactions are joined and written, so
+    the upserts end up the same as the batch task groups while memory stays bounded by `chunksize`
+    rather than by the file size. Duplicates that span chunks are discarded by the `ON CONFLICT`
+    clauses, as the `rowId` hash of a row does not depend on the chunk it was read in.
+
+    :param run_date: The date for which the data is being processed.
+    :param s3_path: S3 path for the data.
+    :param database_obj: Dictionary containing database connection details (host, user, port, db, password).
+    :param chunksize: Number of CSV rows processed at a time.
+    :param incremental: Whether to skip rows already loaded and push the file's watermark to XCom
+        (see `get_transaction_data`).
     :return:
     """
-    cur = establish_connection(host=database_obj["host"], user=database_obj["user"], port=database_obj["port"],
-                               db=database_obj["db"],
-                               password=database_obj["password"])
-    execute_batch(cur, query, data, page_size=1000)
-    print("batch insert complete")
+    bucket, key = split_s3_path(s3_path.format(run_date))
+    local_path = fetch_cached(bucket, key)
+    user_cache = get_user_cache()
+    row_id_filter = get_row_id_filter()
+    # the rowIds written by this run, merged into the filter file at the end
+    added = RowIdBloomFilter.empty_like(row_id_filter) if row_id_filter is not None else None
+    metrics = current_metrics()
+    metrics.add(bytes_read=os.path.getsize(local_path))
+
+    n_rows = 0
+    max_request_timestamp = None
+    with get_cursor(database_obj) as cur:
+        watermark = get_watermark(cur, key) if incremental else None
+        for chunk in read_transactions(local_path, chunksize=chunksize):
+            n_rows += len(chunk)
+            metrics.add(rows_in=len(chunk))
+            if incremental:
+                request_timestamps = epoch_ms(chunk["date"])
+                chunk_max = int(request_timestamps.max())
+                max_request_timestamp = max(max_request_timestamp or chunk_max, chunk_max)
+                chunk = filter_new_rows(chunk, request_timestamps, cur, watermark)
+                if chunk.empty:
+                    continue
+
+            user_data = prepare_user_data(chunk)
+            df_user = upsert_user_uuids(cur, user_data)
+            if user_cache is not None:
+                user_cache.put_many(dict(zip(df_user["phoneNumber"], df_user["uuid"])))
+
+            transaction_data = prepare_transaction_data(chunk, cur, df_user=df_user)
+            if row_id_filter is not None:
+                transaction_data = drop_loaded_rows(transaction_data, cur, row_id_filter)
+            write_rows(cur, transaction_insert, transaction_data, transaction_bulk_load)
+            metrics.add(rows_out=len(transaction_data))
+            if row_id_filter is not None:
+                row_ids = transaction_data["rowId"].tolist()
+                row_id_filter.add_many(row_ids)
+                added.add_many(row_ids)
+
+            print(f"processed {n_rows} rows")
+
+    if added is not None:
+        remember_row_ids(added)
+
+    if incremental:
+        get_current_context()["ti"].xcom_push("watermark", {
+            "fileKey": key,
+            "etag": os.path.splitext(os.path.basename(local_path))[0],
+            "rowCount": n_rows,
+            "maxRequestTimestamp": max_request_timestamp,
+        })
+
+    if user_cache is not None:
+        get_current_context()["ti"].xcom_push("user_cache_stats", user_cache.stats())
+        user_cache.close()
+
+
+@task.short_circuit()
+@profiled
+def check_watermark(run_date: str, s3_path: str, database_obj: dict) -> bool:
+    """
+    Skip the rest of the run when the day's file was already fully loaded.
+
+    The file's current ETag (a HEAD request) is compared with the one recorded by the last
+    successful load, so an unchanged file is skipped without being downloaded.
+
+    :param run_date: The date for which the data is being processed.
+    :param s3_path: S3 path for the data.
+    :param database_obj: Dictionary containing database connection details (host, user, port, db, password).
+    :return: Whether the file has to be loaded.
+    """
+    bucket, key = split_s3_path(s3_path.format(run_date))
+    etag = head_object(bucket, key)["ETag"].strip('"')
+    with get_cursor(database_obj) as cur:
+        watermark = get_watermark(cur, key)
+
+    if watermark is not None and watermark["etag"] == etag:
+        print(f"s3://{bucket}/{key} already loaded ({watermark['rowCount']} rows), skipping")
+        return False
+
+    return True
+
+
+@task()
+@profiled
+def record_watermark(database_obj: dict, source_task_id: str) -> None:
+    """
+    Record the watermark of a fully loaded file.
+
+    :param database_obj: Dictionary containing database connection details (host, user, port, db, password).
+    :param source_task_id: Task that pushed the `watermark` XCom.
+    :return:
+    """
+    watermark = get_current_context()["ti"].xcom_pull(key="watermark", task_ids=source_task_id)
+    if watermark is None:
+        raise AirflowSkipException(f"no watermark pushed by {source_task_id}")
+
+    with get_cursor(database_obj) as cur:
+        cur.execute(create_watermark_table)
+        cur.execute(watermark_upsert, watermark)
+    print(f"recorded watermark {watermark}")
+
+
+@task()
+@profiled
+def clean_up_handoff() -> None:
+    """
+    Delete the handoff files of the run once it loaded successfully, and those of older runs past the retention.
+
+    Failed runs keep their files, so their tasks can be cleared and retried until they are pruned.
+
+    :return:
+    """
+    ti = get_current_context()["ti"]
+    remove_run(ti.dag_id, ti.run_id)
+    prune(ti.dag_id)
@@ -17,3 +17,133 @@ transaction_insert = \
     ON CONFLICT ("rowId")
     DO NOTHING
     """
+
+
+users_bulk_load = {
+    "staging":
+        """
+        CREATE TEMP TABLE IF NOT EXISTS user_airflow_staging AS
+        SELECT "phoneNumber" FROM public."user_airflow"
+        WITH NO DATA
+        """,
+    "copy":
+        """
+        COPY user_airflow_staging("phoneNumber")
+        FROM STDIN WITH (FORMAT csv)
+        """,
+    # inserts the new agents and returns the uuids of every staged agent, flagged by whether they
+    # were inserted, the rows that already existed are read from the statement's snapshot, which
+    # does not see the CTE's inserts
+    "merge":
+        """
+        WITH inserted AS (
+            INSERT INTO
+            public."user_airflow"("phoneNumber")
+            SELECT "phoneNumber" FROM user_airflow_staging
+            ON CONFLICT ("phoneNumber")
+            DO NOTHING
+            RETURNING "phoneNumber", uuid
+        )
+        SELECT "phoneNumber", uuid, true AS inserted FROM inserted
+        UNION ALL
+        SELECT "phoneNumber", uuid, false AS inserted FROM public."user_airflow"
+        WHERE "phoneNumber" IN (SELECT "phoneNumber" FROM user_airflow_staging)
+        """,
+    "cleanup": "TRUNCATE user_airflow_staging",
+    "columns": ["agentPhoneNumber"],
+}
+
+transaction_bulk_load = {
+    "staging":
+        """
+        CREATE TEMP TABLE IF NOT EXISTS transaction_airflow_staging AS
+        SELECT "rowId", "mobile", "category", "userUuid", "balance", "commission",
+               "amount", "requestTimestamp", "updateTimestamp", "externalId"
+        FROM public.transaction_airflow
+        WITH NO DATA
+        """,
+    "copy":
+        """
+        COPY transaction_airflow_staging("rowId", "mobile", "category", "userUuid", "balance", "commission",
+                                         "amount", "requestTimestamp", "updateTimestamp", "externalId")
+        FROM STDIN WITH (FORMAT csv)
+        """,
+    "merge":
+        """
+        INSERT INTO
+        public.transaction_airflow("rowId", "mobile", "category", "userUuid", "balance", "commission",
+                                   "amount", "requestTimestamp", "updateTimestamp", "externalId")
+        SELECT "rowId", "mobile", "category", "userUuid", "balance", "commission",
+               "amount", "requestTimestamp", "updateTimestamp", "externalId"
+        FROM transaction_airflow_staging
+        ON CONFLICT ("rowId")
+        DO NOTHING
+        """,
+    "cleanup": "TRUNCATE transaction_airflow_staging",
+    "columns": ["rowId", "receiverPhoneNumber", "transactionType", "userUuid", "balance", "commission",
+                "amount", "requestTimestamp", "updateTimestamp", "externalId"],
+}
+
+user_lookup = \
+    """
+    SELECT "phoneNumber", uuid
+    FROM public.user_airflow
+    WHERE "phoneNumber" = ANY(%(phone_numbers)s)
+    """
+
+user_lookup_bulk_load = {
+    "staging":
+        """
+        CREATE TEMP TABLE IF NOT EXISTS user_lookup_keys
+        ("phoneNumber" character varying PRIMARY KEY)
+        """,
+    "copy":
+        """
+        COPY user_lookup_keys("phoneNumber")
+        FROM STDIN WITH (FORMAT csv)
+        """,
+    "lookup":
+        """
+        SELECT u."phoneNumber", u.uuid
+        FROM public.user_airflow u
+        JOIN user_lookup_keys k ON k."phoneNumber" = u."phoneNumber"
+        """,
+    "cleanup": "TRUNCATE user_lookup_keys",
+}
+
+create_watermark_table = \
+    """
+    CREATE TABLE IF NOT EXISTS public.ingestion_watermark
+    (
+        "fileKey" character varying NOT NULL,
+        etag character varying NOT NULL,
+        "rowCount" bigint NOT NULL,
+        "maxRequestTimestamp" bigint,
+        "loadedAt" timestamp without time zone NOT NULL DEFAULT now(),
+        CONSTRAINT "PK_ingestion_watermark" PRIMARY KEY ("fileKey")
+    );
+    """
+
+watermark_select = \
+    """
+    SELECT etag, "rowCount", "maxRequestTimestamp"
+    FROM public.ingestion_watermark
+    WHERE "fileKey" = %(fileKey)s
+    """
+
+watermark_upsert = \
+    """
+    INSERT INTO
+    public.ingestion_watermark("fileKey", etag, "rowCount", "maxRequestTimestamp")
+    VALUES(%(fileKey)s, %(etag)s, %(rowCount)s, %(maxRequestTimestamp)s)
+    ON CONFLICT ("fileKey")
+    DO UPDATE SET etag = EXCLUDED.etag, "rowCount" = EXCLUDED."rowCount",
+                  "maxRequestTimestamp" = EXCLUDED."maxRequestTimestamp", "loadedAt" = now()
+    """
+
+existing_row_ids = \
+    """
+    SELECT "rowId"
+    FROM public.transaction_airflow
+    WHERE "rowId" = ANY(%(row_ids)s)
+    """
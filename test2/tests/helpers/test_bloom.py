@@ -0,0 +1,64 @@
+"""Tests for the rowId Bloom filter."""
+
+import hashlib
+import pytest
+from include.helpers.bloom import RowIdBloomFilter
+
+
+def row_ids(start: int, stop: int) -> list[str]:
+    return [hashlib.md5(str(i).encode("utf-8")).hexdigest() for i in range(start, stop)]
+
+
+def test_bloom_filter_has_no_false_negatives():
+    """
+    test if every added rowId is reported as possibly present
+    """
+    bloom = RowIdBloomFilter.create(capacity=1_000, fp_rate=0.01)
+    bloom.add_many(row_ids(0, 1_000))
+
+    assert bloom.contains_many(row_ids(0, 1_000)).all()
+
+
+def test_bloom_filter_false_positive_rate():
+    """
+    test if unseen rowIds are rejected at about the configured false-positive rate
+    """
+    bloom = RowIdBloomFilter.create(capacity=1_000, fp_rate=0.01)
+    bloom.add_many(row_ids(0, 1_000))
+
+    assert bloom.contains_many(row_ids(1_000, 11_000)).mean() < 0.03
+
+
+def test_bloom_filter_save_and_mmap_load(tmp_path):
+    """
+    test if a saved filter is memory-mapped back with the same content
+    """
+    path = str(tmp_path / "row_ids.bloom")
+    bloom = RowIdBloomFilter.create(capacity=1_000, fp_rate=0.01)
+    bloom.add_many(row_ids(0, 100))
+    bloom.save(path)
+
+    loaded = RowIdBloomFilter.load(path)
+    assert loaded.count == 100
+    assert loaded.contains_many(row_ids(0, 100)).all()
+
+    loaded.add_many(row_ids(100, 200))
+    loaded.save(path)
+    assert RowIdBloomFilter.load(path).contains_many(row_ids(0, 200)).all()
+
+
+def test_bloom_filter_update():
+    """
+    test if merging the additions of another filter keeps the rowIds of both, and other sizes are rejected
+    """
+    bloom = RowIdBloomFilter.create(capacity=1_000, fp_rate=0.01)
+    bloom.add_many(row_ids(0, 100))
+    added = RowIdBloomFilter.empty_like(bloom)
+    added.add_many(row_ids(100, 200))
+
+    bloom.update(added)
+    assert bloom.count == 200
+    assert bloom.contains_many(row_ids(0, 200)).all()
+
+    with pytest.raises(ValueError):
+        bloom.update(RowIdBloomFilter.create(capacity=2_000, fp_rate=0.01))
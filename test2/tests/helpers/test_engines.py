@@ -0,0 +1,40 @@
+"""Parity tests for the transform engines."""
+
+import datetime as dt
+from zoneinfo import ZoneInfo
+import pandas as pd
+import pytest
+from include.helpers.engines import ENGINES, DATE_FORMAT, epoch_ms, pl
+
+DATES = pd.Series(["2023-06-01 12:57:41", "2023-03-12 02:30:00", "2023-11-05 01:30:00", "2023-06-01 12:57:41"],
+                  index=[3, 1, 1, 0])
+
+
+@pytest.mark.parametrize("engine", [e for e in ENGINES if e != "polars" or pl is not None])
+@pytest.mark.parametrize("tz", ["America/New_York", "Europe/London", "UTC"])
+def test_epoch_ms_parity(engine, tz):
+    """
+    test if every engine matches the row-wise strptime conversion, including DST gaps and overlaps
+    """
+    expected = [int(dt.datetime.strptime(x, DATE_FORMAT).replace(tzinfo=ZoneInfo(tz)).timestamp() * 1000)
+                for x in DATES]
+    result = epoch_ms(DATES, tz, engine)
+
+    assert result.tolist() == expected
+    assert result.index.equals(DATES.index)
+
+
+def test_unknown_engine():
+    """
+    test if an unknown engine is rejected
+    """
+    with pytest.raises(ValueError):
+        epoch_ms(DATES, engine="spark")
+
+
+def test_epoch_ms_local_timezone():
+    """
+    test if the dates are read in the local timezone by default, like the row-wise strptime conversion
+    """
+    expected = [int(dt.datetime.strptime(x, DATE_FORMAT).timestamp() * 1000) for x in DATES]
+    assert list(epoch_ms(DATES)) == expected
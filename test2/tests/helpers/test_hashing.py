@@ -0,0 +1,53 @@
+"""Tests for the rowId hashing."""
+
+import io
+import numpy as np
+import pandas as pd
+from include.helpers.engines import epoch_ms
+from include.helpers.hashing import hash_row, hash_rows
+from include.helpers.schema import read_transactions
+
+TRANSACTIONS_CSV = """date,externalId,agentPhoneNumber,transactionType,amount,balance,receiverPhoneNumber,commission
+2023-06-01 11:57:41,c3674bd2,220789778240,deposit,4000.0,1720000.0,220772108589,110.0
+2023-06-01 16:02:10,,220787000654,withdrawal,250.0,90000.0,220773000070,10.0
+"""
+
+
+def sample_transactions(n_rows: int) -> pd.DataFrame:
+    return pd.DataFrame({
+        "requestTimestamp": 1685620661000 + np.arange(n_rows) * 1000,
+        "agentPhoneNumber": [str(220789778240 + i % 7) for i in range(n_rows)],
+        "externalId": [f"c3674bd214f4221bee3e{i}" for i in range(n_rows - 1)] + [np.nan],
+    })
+
+
+def test_hash_rows_matches_hash_row():
+    """
+    test if the batched hashes are identical to the row-wise hashes, missing values included
+    """
+    df = sample_transactions(50)
+    assert hash_rows(df).tolist() == df.apply(hash_row, axis=1).tolist()
+
+
+def test_hash_rows_process_pool():
+    """
+    test if hashing across a process pool keeps the digests and their order
+    """
+    df = sample_transactions(50)
+    assert hash_rows(df, processes=2, chunksize=8).tolist() == hash_rows(df).tolist()
+
+
+def test_hash_rows_declared_schema():
+    """
+    test if rows read with the declared schema, a missing externalId included, keep the rowIds of the inferred read
+    """
+    with pd.option_context("future.infer_string", False):
+        inferred = pd.read_csv(io.StringIO(TRANSACTIONS_CSV))
+    inferred["requestTimestamp"] = epoch_ms(inferred["date"])
+
+    df = read_transactions(io.StringIO(TRANSACTIONS_CSV))
+    df["requestTimestamp"] = epoch_ms(df["date"])
+    df["agentPhoneNumber"] = df["agentPhoneNumber"].map(str)
+
+    assert df["externalId"].isna().sum() == 1
+    assert hash_rows(df).tolist() == inferred.apply(hash_row, axis=1).tolist()
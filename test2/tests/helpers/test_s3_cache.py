@@ -0,0 +1,46 @@
+"""Tests for the eviction of the local S3 object cache."""
+
+import os
+import time
+import pytest
+
+pytest.importorskip("boto3")
+
+from include.helpers.s3_cache import evict  # noqa: E402
+
+
+def cache_file(directory, name: str, size: int, age: float) -> str:
+    path = str(directory / name)
+    with open(path, "wb") as file:
+        file.write(b"x" * size)
+    used = time.time() - age
+    os.utime(path, (used, used))
+
+    return path
+
+
+def test_evict_least_recently_used_over_size(tmp_path):
+    """
+    test if the least recently used files are deleted until the cache fits, never the one being read
+    """
+    oldest = cache_file(tmp_path, "a.csv", 100, age=300)
+    older = cache_file(tmp_path, "b.csv", 100, age=200)
+    recent = cache_file(tmp_path, "c.csv", 100, age=100)
+    keep = cache_file(tmp_path, "d.csv", 100, age=400)
+
+    assert evict(str(tmp_path), max_bytes=250, max_age=3600, keep=keep) == [oldest, older]
+    assert sorted(os.listdir(tmp_path)) == ["c.csv", "d.csv"]
+    assert os.path.exists(recent)
+
+
+def test_evict_expired_and_partial_files(tmp_path):
+    """
+    test if files unused past the max age are deleted, but not a partial download in progress
+    """
+    expired = cache_file(tmp_path, "a.csv", 10, age=7200)
+    stale_part = cache_file(tmp_path, "b.csv.1.part", 10, age=7200)
+    cache_file(tmp_path, "c.csv.2.part", 10, age=0)
+    cache_file(tmp_path, "d.csv", 10, age=0)
+
+    assert sorted(evict(str(tmp_path), max_bytes=1_000, max_age=3600)) == sorted([expired, stale_part])
+    assert sorted(os.listdir(tmp_path)) == ["c.csv.2.part", "d.csv"]
@@ -0,0 +1,41 @@
+"""Tests for the transaction ingestion schema."""
+
+import io
+import pandas as pd
+from include.helpers.schema import format_cents, read_transactions, to_cents
+
+CSV = """date,externalId,agentPhoneNumber,transactionType,amount,balance,receiverPhoneNumber,commission
+2023-06-01 12:57:41,ab12,220789778240,deposit,4000.0,130000.0,220770000001,0.1
+2023-06-01 13:02:10,cd34,220789778241,withdrawal,12.345,-1.5,220770000002,110
+"""
+
+
+def test_read_transactions_declares_schema():
+    """
+    test if phone numbers stay text, the transaction type is categorical and amounts are cents
+    """
+    df = read_transactions(io.StringIO(CSV))
+
+    assert df["transactionType"].dtype == "category"
+    assert df["agentPhoneNumber"].tolist() == ["220789778240", "220789778241"]
+    assert df["amount"].tolist() == [400000, 1235]
+    assert df["commission"].tolist() == [10, 11000]
+
+
+def test_cents_round_trip():
+    """
+    test if amounts formatted back from cents keep their exact decimal value
+    """
+    cents = to_cents(pd.Series(["4000.0", "-1.5", "-0.125", None]))
+
+    assert format_cents(cents).iloc[:3].tolist() == ["4000.00", "-1.50", "-0.13"]
+    assert pd.isna(format_cents(cents).iloc[3])
+
+
+def test_read_transactions_in_chunks():
+    """
+    test if chunked reads apply the schema to every chunk
+    """
+    chunks = list(read_transactions(io.StringIO(CSV), chunksize=1))
+
+    assert [chunk["balance"].tolist() for chunk in chunks] == [[13000000], [-150]]
@@ -0,0 +1,56 @@
+"""Tests keeping the helpers copied between the standalone scripts in test1 and the Airflow project in sync."""
+
+import ast
+import os
+import pytest
+
+TEST2 = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+TEST1 = os.path.join(TEST2, "..", "test1")
+
+if not os.path.isdir(TEST1):
+    pytest.skip("the test1 scripts are not checked out next to this project", allow_module_level=True)
+
+# (test1 module, function) and the (test2 module, function) it is copied to, schema.py is copied whole
+SHARED_FUNCTIONS = [
+    (("utils.py", "local_offsets_ms"), ("include/helpers/engines.py", "local_offsets_ms")),
+    (("utils.py", "to_epoch_ms"), ("include/helpers/engines.py", "epoch_ms_pandas")),
+    (("utils.py", "frame_to_csv"), ("include/helpers/utils.py", "frame_to_csv")),
+    (("utils.py", "frame_records"), ("include/helpers/utils.py", "frame_records")),
+    (("utils.py", "to_python"), ("include/helpers/utils.py", "to_python")),
+]
+
+
+def function_body(path: str, name: str) -> str:
+    """
+    Dump the code of a module-level function, without its name and docstring.
+
+    :param path: Path of the module.
+    :param name: Name of the function.
+    :return: AST dump of the function.
+    """
+    with open(path) as file:
+        tree = ast.parse(file.read())
+    function = next(node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name == name)
+    if function.body and isinstance(function.body[0], ast.Expr) and isinstance(function.body[0].value, ast.Constant):
+        function.body = function.body[1:]
+    function.name = ""
+
+    return ast.dump(function)
+
+
+@pytest.mark.parametrize("test1, test2", SHARED_FUNCTIONS, ids=[f"{t2[0]}:{t2[1]}" for _, t2 in SHARED_FUNCTIONS])
+def test_shared_functions_match(test1, test2):
+    """
+    test if the copies of the shared helpers in test1 and test2 have the same code
+    """
+    assert function_body(os.path.join(TEST1, test1[0]), test1[1]) == \
+        function_body(os.path.join(TEST2, test2[0]), test2[1])
+
+
+def test_schema_copies_match():
+    """
+    test if the transaction schema of test1 is the same file as the one of the Airflow project
+    """
+    with open(os.path.join(TEST1, "schema.py"), "rb") as test1, \
+            open(os.path.join(TEST2, "include", "helpers", "schema.py"), "rb") as test2:
+        assert test1.read() == test2.read()
@@ -0,0 +1,43 @@
+"""Tests for the persistent phoneNumber -> uuid cache."""
+
+from include.helpers.user_cache import UserCache
+
+
+def test_user_cache_counts_hits_and_misses(tmp_path):
+    """
+    test if lookups report hits and misses and return only cached mappings
+    """
+    with UserCache(str(tmp_path / "users.sqlite")) as cache:
+        cache.put_many({"220789778240": "7f9c0f3e-51a8-4ab5-9b6e-0c1d2a4e5f60"})
+
+        assert cache.get_many(["220789778240", "220772108589"]) == {
+            "220789778240": "7f9c0f3e-51a8-4ab5-9b6e-0c1d2a4e5f60"
+        }
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+
+def test_user_cache_evicts_least_recently_used(tmp_path):
+    """
+    test if the cache stays within max_size by evicting the least recently used mapping
+    """
+    with UserCache(str(tmp_path / "users.sqlite"), max_size=2) as cache:
+        cache.put_many({"1": "a"})
+        cache.put_many({"2": "b"})
+        cache.get_many(["1"])
+        cache.put_many({"3": "c"})
+
+        assert len(cache) == 2
+        assert cache.get_many(["1", "2", "3"]) == {"1": "a", "3": "c"}
+
+
+def test_user_cache_persists_between_runs(tmp_path):
+    """
+    test if mappings written by one run are read back by the next one
+    """
+    path = str(tmp_path / "users.sqlite")
+    with UserCache(path) as cache:
+        cache.put_many({"220789778240": "a"})
+
+    with UserCache(path) as cache:
+        assert cache.get_many(["220789778240"]) == {"220789778240": "a"}
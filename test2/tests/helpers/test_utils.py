@@ -0,0 +1,95 @@
+"""Tests for the pooled database connections."""
+
+import threading
+import pytest
+from psycopg2.pool import PoolError
+
+pytest.importorskip("airflow")
+
+from include.helpers import utils  # noqa: E402
+
+DATABASE = {"host": "localhost", "port": 5432, "db": "test", "user": "test", "password": "test"}
+
+
+class FakeConnection:
+    closed = 0
+    autocommit = True
+
+    def cursor(self):
+        return FakeCursor()
+
+    def rollback(self):
+        pass
+
+
+class FakeCursor:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query):
+        pass
+
+
+class FakePool:
+    """
+    Hands out at most `maxconn` connections and raises PoolError beyond, like psycopg2's pools.
+    """
+
+    def __init__(self, minconn, maxconn, **kwargs):
+        self.maxconn = maxconn
+        self.used = 0
+
+    def getconn(self):
+        if self.used == self.maxconn:
+            raise PoolError("connection pool exhausted")
+        self.used += 1
+        return FakeConnection()
+
+    def putconn(self, conn, close=False):
+        self.used -= 1
+
+    def closeall(self):
+        pass
+
+
+def test_get_connection_waits_for_a_free_connection(monkeypatch):
+    """
+    test if borrowing from an exhausted pool waits for a connection to be returned instead of failing
+    """
+    monkeypatch.setattr(utils, "POOL_SIZE", 1)
+    monkeypatch.setattr(utils, "ThreadedConnectionPool", FakePool)
+    utils.close_pools()
+
+    borrowed = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def hold():
+        with utils.get_connection(DATABASE):
+            borrowed.set()
+            release.wait()
+
+    def borrow():
+        try:
+            with utils.get_connection(DATABASE):
+                pass
+        except PoolError as error:
+            errors.append(error)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    borrowed.wait()
+    waiter = threading.Thread(target=borrow)
+    waiter.start()
+    waiter.join(0.2)
+    assert waiter.is_alive()
+
+    release.set()
+    holder.join()
+    waiter.join()
+    assert errors == []
+    assert utils._pools_in_use[utils.pool_key(DATABASE)] == 0
+    utils.close_pools()
@@ -0,0 +1,227 @@
+"""Tests for the incremental load and shard checks of the daily transaction DAG."""
+
+import io
+import csv
+import hashlib
+from contextlib import nullcontext
+import pandas as pd
+import pytest
+from include.helpers import bloom
+from include.helpers.engines import epoch_ms
+from include.helpers.schema import read_transactions
+from include.scripts import daily_transaction_callables
+from include.helpers.hashing import hash_rows
+from include.scripts.daily_transaction_callables import (check_watermark, filter_new_rows, get_watermark,
+                                                         lookup_user_uuids, verify_shards)
+from include.sql.daily_transaction_sql import existing_row_ids, user_lookup, user_lookup_bulk_load, watermark_select
+
+TRANSACTIONS_CSV = """date,externalId,agentPhoneNumber,transactionType,amount,balance,receiverPhoneNumber,commission
+2023-06-01 11:57:41,c3674bd2,220789778240,deposit,4000.0,1720000.0,220772108589,110.0
+2023-06-01 14:31:44,df9ca810,220789778240,deposit,130000.0,1888000.0,220773000069,500.0
+2023-06-01 16:02:10,,220787000654,withdrawal,250.0,90000.0,220773000070,10.0
+2023-06-01 18:45:00,aa01bb02,220787000654,transfer,99.5,89750.0,220773000071,1.0
+"""
+
+
+class FakeCursor:
+    """
+    Records the statements, returns a watermark row, the rowIds of `loaded` and the uuids of `users`
+    that a query asks for.
+    """
+
+    def __init__(self, watermark_row: tuple = None, loaded=(), users: dict = None):
+        self.watermark_row = watermark_row
+        self.loaded = set(loaded)
+        self.users = users or {}
+        self.lookup_keys = []
+        self.statements = []
+
+    def execute(self, query, params=None):
+        self.statements.append((query, params))
+        if query == user_lookup_bulk_load["cleanup"]:
+            self.lookup_keys = []
+
+    def copy_expert(self, query, file):
+        self.statements.append((query, None))
+        self.lookup_keys.extend(key for key, in csv.reader(file))
+
+    def fetchone(self):
+        assert self.statements[-1][0] == watermark_select
+        return self.watermark_row
+
+    def fetchall(self):
+        query, params = self.statements[-1]
+        if query == user_lookup:
+            return [(key, self.users[key]) for key in params["phone_numbers"] if key in self.users]
+        if query == user_lookup_bulk_load["lookup"]:
+            return [(key, self.users[key]) for key in self.lookup_keys if key in self.users]
+        assert query == existing_row_ids
+        return [(row_id,) for row_id in params["row_ids"] if row_id in self.loaded]
+
+    def queried_row_ids(self) -> list[str]:
+        return [row_id for query, params in self.statements if query == existing_row_ids
+                for row_id in params["row_ids"]]
+
+
+def read_sample() -> tuple[pd.DataFrame, pd.Series, pd.Series]:
+    df = read_transactions(io.StringIO(TRANSACTIONS_CSV))
+    request_timestamps = epoch_ms(df["date"])
+    row_ids = hash_rows(pd.DataFrame({"requestTimestamp": request_timestamps,
+                                      "agentPhoneNumber": df["agentPhoneNumber"].map(str),
+                                      "externalId": df["externalId"]}))
+
+    return df, request_timestamps, row_ids
+
+
+def test_get_watermark():
+    """
+    test if a missing watermark reads as None and a recorded one as a dictionary
+    """
+    assert get_watermark(FakeCursor(), "raw/transactions/transactions-2023-06-01.csv") is None
+    assert get_watermark(FakeCursor(("etag-1", 4, 1685620661000)), "raw/transactions/transactions-2023-06-01.csv") \
+        == {"etag": "etag-1", "rowCount": 4, "maxRequestTimestamp": 1685620661000}
+
+
+def test_lookup_user_uuids_bound_array():
+    """
+    test if up to the threshold the phone numbers are sent as one bound array
+    """
+    cur = FakeCursor(users={"220789778240": "uuid-1", "220787000654": "uuid-2"})
+
+    result = lookup_user_uuids(cur, ["220789778240", "220787000654", "220700000000"])
+
+    assert cur.statements == [(user_lookup, {"phone_numbers": ["220789778240", "220787000654", "220700000000"]})]
+    assert result.to_dict("records") == [{"phoneNumber": "220789778240", "uuid": "uuid-1"},
+                                         {"phoneNumber": "220787000654", "uuid": "uuid-2"}]
+
+
+def test_lookup_user_uuids_temp_table():
+    """
+    test if above the threshold the phone numbers are copied into the temp table, joined and truncated again
+    """
+    cur = FakeCursor(users={"220789778240": "uuid-1", "220787000654": "uuid-2"})
+
+    result = lookup_user_uuids(cur, ["220789778240", "220787000654", "220700000000"], temp_table_threshold=1)
+
+    assert [query for query, _ in cur.statements] == [
+        user_lookup_bulk_load["staging"], user_lookup_bulk_load["cleanup"], user_lookup_bulk_load["copy"],
+        user_lookup_bulk_load["lookup"], user_lookup_bulk_load["cleanup"]
+    ]
+    assert cur.lookup_keys == []
+    assert result.to_dict("records") == [{"phoneNumber": "220789778240", "uuid": "uuid-1"},
+                                         {"phoneNumber": "220787000654", "uuid": "uuid-2"}]
+
+
+def test_lookup_user_uuids_empty():
+    """
+    test if no phone numbers give an empty frame without querying the database
+    """
+    cur = FakeCursor()
+
+    result = lookup_user_uuids(cur, [], temp_table_threshold=1)
+
+    assert cur.statements == []
+    assert result.empty and list(result.columns) == ["phoneNumber", "uuid"]
+
+
+def test_filter_new_rows_without_watermark():
+    """
+    test if every row of a file that was never loaded is kept without querying the transaction table
+    """
+    df, request_timestamps, _ = read_sample()
+    cur = FakeCursor()
+
+    assert filter_new_rows(df, request_timestamps, cur, None).equals(df)
+    assert filter_new_rows(df, request_timestamps, cur, {"maxRequestTimestamp": None}).equals(df)
+    assert cur.statements == []
+
+
+def test_filter_new_rows_newer_than_watermark():
+    """
+    test if rows newer than the watermark are kept without being looked up
+    """
+    df, request_timestamps, row_ids = read_sample()
+    cur = FakeCursor(loaded=row_ids[:2])
+    watermark = {"maxRequestTimestamp": int(request_timestamps.iloc[1])}
+
+    result = filter_new_rows(df, request_timestamps, cur, watermark)
+
+    assert result.index.tolist() == [2, 3]
+    assert sorted(cur.queried_row_ids()) == sorted(row_ids[:2])
+
+
+def test_filter_new_rows_older_than_watermark():
+    """
+    test if older rows are dropped only when their rowId is already in the transaction table
+    """
+    df, request_timestamps, row_ids = read_sample()
+    cur = FakeCursor(loaded=[row_ids[0], row_ids[2]])
+    watermark = {"maxRequestTimestamp": int(request_timestamps.max())}
+
+    result = filter_new_rows(df, request_timestamps, cur, watermark)
+
+    assert result.index.tolist() == [1, 3]
+    assert sorted(cur.queried_row_ids()) == sorted(row_ids)
+
+
+def test_check_watermark_skips_unchanged_file(monkeypatch):
+    """
+    test if the run is skipped when the file's ETag matches the last load, and goes ahead otherwise
+    """
+    monkeypatch.setattr(daily_transaction_callables, "head_object", lambda bucket, key: {"ETag": '"etag-1"'})
+
+    def run(watermark_row):
+        cur = FakeCursor(watermark_row)
+        monkeypatch.setattr(daily_transaction_callables, "get_cursor", lambda database_obj: nullcontext(cur))
+        return check_watermark.function("2023-06-01", "mide-product-dump/raw/transactions-{}.csv", {})
+
+    assert run(("etag-1", 4, 1685620661000)) is False
+    assert run(("etag-0", 4, 1685620661000)) is True
+    assert run(None) is True
+
+
+def test_verify_shards(monkeypatch):
+    """
+    test if the shard check reports the rows dropped by the transforms and fails on rowIds missing from the table
+    """
+    frames = {
+        "input": pd.DataFrame({"rowId": ["a", "b", "c", "c", "d"]}),
+        "shard-0": pd.DataFrame({"rowId": ["a", "b"]}),
+        "shard-1": pd.DataFrame({"rowId": ["c", "c", "d"]}),
+        "ready-0": pd.DataFrame({"rowId": ["a", "b"]}),
+        "ready-1": pd.DataFrame({"rowId": ["c", "d"]}),
+    }
+    monkeypatch.setattr(daily_transaction_callables, "count_rows", lambda ref: len(frames[ref]))
+    monkeypatch.setattr(daily_transaction_callables, "load", lambda ref, columns=None: frames[ref][columns])
+
+    counts = verify_shards.function("input", ["shard-0", "shard-1"], ["ready-0", "ready-1"], [2, 2])
+    assert (counts["dropped"], counts["transformed_row_ids"]) == (1, 4)
+
+    with pytest.raises(ValueError, match="3 rowIds found"):
+        verify_shards.function("input", ["shard-0", "shard-1"], ["ready-0", "ready-1"], [2, 1])
+
+
+def test_verify_shards_remembers_row_ids(monkeypatch, tmp_path):
+    """
+    test if the confirmed rowIds are merged into the Bloom filter file, keeping the rowIds it already held
+    """
+    row_ids = [hashlib.md5(str(i).encode("utf-8")).hexdigest() for i in range(4)]
+    frames = {
+        "input": pd.DataFrame({"rowId": row_ids[1:]}),
+        "ready-0": pd.DataFrame({"rowId": row_ids[1:]}),
+    }
+    monkeypatch.setattr(daily_transaction_callables, "count_rows", lambda ref: len(frames[ref]))
+    monkeypatch.setattr(daily_transaction_callables, "load", lambda ref, columns=None: frames[ref][columns])
+
+    path = str(tmp_path / "row_ids.bloom")
+    monkeypatch.setattr(bloom, "ROWID_BLOOM_PATH", path)
+    monkeypatch.setattr(daily_transaction_callables, "ROWID_BLOOM_PATH", path)
+    existing = bloom.RowIdBloomFilter.create(capacity=1_000, fp_rate=0.01)
+    existing.add_many(row_ids[:1])
+    existing.save(path)
+
+    verify_shards.function("input", ["input"], ["ready-0"], [3])
+
+    merged = bloom.RowIdBloomFilter.load(path)
+    assert merged.count == 4
+    assert merged.contains_many(row_ids).all()